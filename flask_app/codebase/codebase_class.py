@@ -1,14 +1,22 @@
 import os
 import json
 import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from config import IGNORE_PATH
+from config import IGNORE_PATH, SUMMARY_MAX_WORKERS, RELEVANT_CODE_SUMMARY_TOKENS, RELEVANT_CODE_FOLDER_TOKENS, \
+    RELEVANT_CODE_TOP_K, DIRECTORY_SUMMARY_INPUT_TOKENS
 
 from sqlalchemy import Column, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 
-from llm.llm_calls import summarize, describe_application
+from llm.llm_calls import summarize, summarize_directory, describe_application
+from utils.response_cache import get_response_cache
+from utils.repo_scanner import scan_repository
+from utils.ignore_matcher import load_ignore_matcher
+from utils.client_registry import get_embeddings
+from utils.context_selection import select_within_budget, truncate_to_budget, count_tokens
 
 Base = declarative_base()
 
@@ -17,11 +25,14 @@ class Codebase(Base):
     __tablename__ = 'codebases'
 
     id = Column(Integer, primary_key=True)
-    name = Column(String)
+    name = Column(String, index=True)
     directory = Column(String)
-    folder_structure = Column(String)
-    summary = Column(String)
-    description = Column(String)
+    # Large texts are only loaded when accessed (all together, as one group), so listings don't read them
+    folder_structure = deferred(Column(String), group='content')
+    summary = deferred(Column(String), group='content')
+    summary_manifest = deferred(Column(String), group='content')
+    directory_summaries = deferred(Column(String), group='content')
+    description = deferred(Column(String), group='content')
     ignore_file_path = Column(String)
 
     user_stories = relationship('UserStory', back_populates='codebase')
@@ -31,125 +42,302 @@ class Codebase(Base):
         self.name = name
         self.directory = directory
         self.summary = None
+        self.summary_manifest = None
+        self.directory_summaries = None
         self.description = None
         self.ignore_file_path = ignore_file_path
         self.folder_structure = self.extract_folder_structure()
 
     @property
-    def ignore_config(self):
-        return self._load_ignore_config()
+    def ignore_matcher(self):
+        # Compiled once and cached per ignore file, until the file is modified
+        return load_ignore_matcher(self.ignore_file_path)
 
-    def _load_ignore_config(self):
-        try:
-            with open(self.ignore_file_path, 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            print(f"Warning: Ignore file not found at {self.ignore_file_path}. Using empty configuration.")
-            return {'ignored_directories': [], 'ignored_files': [], 'ignored_extensions': []}
-        except json.JSONDecodeError:
-            print(f"Warning: Invalid JSON in ignore file at {self.ignore_file_path}. Using empty configuration.")
-            return {'ignored_directories': [], 'ignored_files': [], 'ignored_extensions': []}
+    def scan(self):
+        """Traverse the codebase directory once; the resulting manifest can be shared by all consumers."""
+        return scan_repository(self.directory, self.ignore_matcher)
 
-    def extract_folder_structure(self):
-        ignored_directories = set(self.ignore_config.get('ignored_directories', []))
+    def extract_folder_structure(self, manifest=None):
+        manifest = manifest or self.scan()
+        return manifest.folder_structure()
 
-        def extract_structure(path, indent=""):
-            result = []
-            folder_name = os.path.basename(path)
-
-            if folder_name in ignored_directories:
-                return []
+    def generate_summary(self, models, socketio=None, max_workers=SUMMARY_MAX_WORKERS, manifest=None, use_cache=True):
+        print("Summarizing codebase..")
+        return self._refresh_summary(models, socketio, max_workers, manifest, use_cache)
 
-            result.append(f"{indent}{folder_name}/")
+    def update_summary(self, models, socketio=None, max_workers=SUMMARY_MAX_WORKERS, manifest=None, use_cache=True,
+                       relative_paths=None):
+        """Refresh the summary; with `relative_paths` given only those files are checked for changes."""
+        print("Updating codebase summary for changed files..")
+        manifest = manifest or self.scan()
+        self.folder_structure = self.extract_folder_structure(manifest)
+        return self._refresh_summary(models, socketio, max_workers, manifest, use_cache, relative_paths)
 
-            if os.path.isdir(path):
-                try:
-                    items = sorted(os.listdir(path))
-                    for item in items:
-                        item_path = os.path.join(path, item)
-                        if os.path.isdir(item_path):
-                            result.extend(extract_structure(item_path, indent + "  "))
-                        else:
-                            result.append(f"{indent}  {item}")
-                except PermissionError:
-                    result.append(f"{indent}  [Permission Denied]")
-                except Exception as e:
-                    result.append(f"{indent}  [Error: {str(e)}]")
+    def _load_summary_manifest(self):
+        # Databases created before the manifest existed only have the summary string. Those summaries can't be
+        # tied to a file version (or, for files with the same name, to a file), so the first refresh redoes them.
+        return json.loads(self.summary_manifest) if self.summary_manifest else {}
 
-            return result
+    def _parse_legacy_summary(self):
+        if not self.summary:
+            return {}
 
-        return "\n".join(extract_structure(self.directory))
+        summary_parts = self.summary.split("\n\nFile: ")
+        summary_parts[0] = summary_parts[0][6:]
 
-    def generate_summary(self, models):
-        print("Summarizing codebase..")
+        summary_map = {}
+        for part in summary_parts:
+            if '\n' not in part:
+                continue
+            file_name, file_summary = part.split('\n', 1)
+            if file_summary.startswith("Error summarizing file: "):
+                continue
+            summary_map[file_name] = file_summary.removeprefix("Summary of file: ").strip()
+        return summary_map
+
+    def _refresh_summary(self, models, socketio=None, max_workers=SUMMARY_MAX_WORKERS, manifest=None, use_cache=True,
+                         relative_paths=None):
+        """
+        Bring the summary in line with the files on disk, using the per-file summary manifest (path, size, mtime,
+        content hash and summary). Only new files and files whose content hash changed are sent to the LLM,
+        summaries of deleted files are dropped. With an empty manifest all files are refreshed, even if only
+        `relative_paths` were asked for.
+        """
+        manifest = manifest or self.scan()
+        summary_manifest = self._load_summary_manifest()
+        to_summarize = {}
+        if not summary_manifest:
+            # Without a manifest (e.g. a codebase from before it existed) the other files have no summaries to keep
+            relative_paths = None
+
+        if relative_paths is None:
+            new_summary_manifest = {}
+            candidates = manifest.included_files()
+        else:
+            # Only the given files (and files that failed before) are compared, the other summaries are kept
+            retry = {path for path, entry in summary_manifest.items() if entry.get('summary') is None}
+            new_summary_manifest = {path: entry for path, entry in summary_manifest.items()
+                                    if path not in relative_paths and path not in retry}
+            candidates = [file_entry for file_entry in map(manifest.get, sorted(set(relative_paths) | retry))
+                          if file_entry and not file_entry.ignored and not file_entry.is_binary]
+
+        for file_entry in candidates:
+            entry = summary_manifest.get(file_entry.relative_path)
+            new_entry = {'size': file_entry.size, 'mtime': file_entry.mtime, 'hash': file_entry.hash, 'summary': None}
+
+            if entry and entry.get('summary') is not None and entry.get('hash') == file_entry.hash:
+                new_entry['summary'] = entry['summary']
+            else:
+                with open(file_entry.path, 'r', encoding='utf-8', errors='ignore') as f:
+                    to_summarize[file_entry.relative_path] = f.read()
+            new_summary_manifest[file_entry.relative_path] = new_entry
+
+        removed = len(set(summary_manifest) - set(new_summary_manifest))
+        print(f"{len(to_summarize)} file(s) to summarize, {removed} removed file(s) dropped from summary.")
+
+        summaries = self._summarize_files(to_summarize, models, socketio, max_workers, use_cache)
         result = []
-
-        for root, dirs, files in os.walk(self.directory):
-            dirs[:] = [d for d in dirs if d not in self.ignore_config.get('ignored_directories', [])]
-
-            for file in files:
-                if file in self.ignore_config.get('ignored_files', []) or \
-                   any(file.endswith(ext) for ext in self.ignore_config.get('ignored_extensions', [])):
+        new_summary_manifest = dict(sorted(new_summary_manifest.items()))
+        for rel_path, entry in new_summary_manifest.items():
+            file_name = os.path.basename(rel_path)
+            if rel_path in summaries:
+                entry['summary'], error = summaries[rel_path]
+                if error is not None:
+                    # Keep the entry without summary, so the file is retried on the next refresh
+                    result.append(f"File: {file_name}\nError summarizing file: {error}\n")
                     continue
+            result.append(f"File: {file_name}\nSummary of file: {entry['summary']}\n")
 
-                path = os.path.join(root, file)
-                try:
-                    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read()
-
-                    summary = summarize(content, models)
-                    result.append(f"File: {os.path.basename(file)}\nSummary of file: {summary}\n")
-                except Exception as e:
-                    result.append(f"File: {os.path.basename(file)}\nError summarizing file: {str(e)}\n")
-
+        self.summary_manifest = json.dumps(new_summary_manifest)
         self.summary = "\n".join(result)
+        self._refresh_directory_summaries(models, socketio, max_workers, use_cache)
         return self.summary
 
-    def update_summary(self, models):
-        print("Updating codebase summary for recently changed files...")
-
-        # Get the current time
-        now = time.time()
-        time_ago = now - 180
-
-        # Split existing summary into parts
-        updated_summary_parts = self.summary.split("\n\nFile: ")
-        updated_summary_parts[0] = updated_summary_parts[0][6:]
-
-        # Create a map of filenames to their summaries
-        summary_map = {}
-        for part in updated_summary_parts:
-            file_name, summary = part.split('\n', 1)
-            summary_map[file_name] = f"File: {file_name}\n{summary}"
-
-        # Recursively traverse the directory and its subdirectories
-        for root, dirs, files in os.walk(self.directory):
-            # Skip directories and files specified in ignore configurations
-            dirs[:] = [d for d in dirs if d not in self.ignore_config.get('ignored_directories', [])]
-            files[:] = [f for f in files if f not in self.ignore_config.get('ignored_files', []) and not any(
-                f.endswith(ext) for ext in self.ignore_config.get('ignored_directories', []))]
-
-            for file in files:
-                # Create the full path to the current file
-                path = os.path.join(root, file)
-
-                # Check if the file was modified within the last 3 minutes
-                if os.path.getmtime(path) >= time_ago:
-                    # Open the file and read its content
-                    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read()
-
-                    # Start summarization
-                    new_summary = summarize(content, models)
-
-                    # Update the summary in the map
-                    summary_map[file] = f"File: {file}\n{new_summary}"
-
-        # Rebuild the updated summary from the map
-        self.summary = "\n\n".join(summary_map.values())
-
-        return self.summary
+    def _directory_tree(self):
+        """Map every directory ('' is the root) to its (file name, summary) pairs and its subdirectories."""
+        tree = {'': ([], [])}
+
+        def add_directory(directory):
+            if directory in tree:
+                return
+            parent = directory.rpartition('/')[0]
+            add_directory(parent)
+            tree[directory] = ([], [])
+            tree[parent][1].append(directory)
+
+        for rel_path, entry in sorted(json.loads(self.summary_manifest or '{}').items()):
+            if entry.get('summary') is None:
+                continue
+            directory, _, file_name = rel_path.rpartition('/')
+            add_directory(directory)
+            tree[directory][0].append((file_name, entry['summary']))
+        return tree
+
+    def _refresh_directory_summaries(self, models, socketio=None, max_workers=SUMMARY_MAX_WORKERS, use_cache=True):
+        """
+        Roll the file summaries up into a summary per directory and one for the root, bottom-up. A directory is only
+        summarized again when the summaries of its direct children changed, so after a small change only the
+        ancestors of the changed files are recomputed. A directory with a single child reuses the child's summary.
+        """
+        tree = self._directory_tree()
+        old_summaries = json.loads(self.directory_summaries or '{}')
+        new_summaries = {}
+        model_name = models['simple_task_model']
+
+        def depth(directory):
+            return directory.count('/') + 1 if directory else 0
+
+        def children(directory):
+            # (heading, summary) of every file and (already summarized) subdirectory
+            files, subdirectories = tree[directory]
+            result = [(f"File: {file_name}\nSummary of file: ", summary) for file_name, summary in files]
+            for subdirectory in subdirectories:
+                summary = new_summaries.get(subdirectory, {}).get('summary')
+                if summary is not None:
+                    result.append((f"Directory: {subdirectory.rpartition('/')[2]}/\nSummary of directory: ", summary))
+            return result
 
-    def describe_application(self, models):
-        self.description = describe_application(self.summary, self.folder_structure, models)
+        summarized = 0
+        # Process the deepest directories first, summarizing the directories of one level concurrently
+        for level in sorted({depth(directory) for directory in tree}, reverse=True):
+            to_summarize = {}
+            for directory in [d for d in tree if depth(d) == level]:
+                parts = children(directory)
+                if not parts:
+                    continue
+                content = "\n".join(f"{heading}{summary}\n" for heading, summary in parts)
+                content_hash = hashlib.sha256(content.encode('utf-8', errors='ignore')).hexdigest()
+                old = old_summaries.get(directory)
+
+                if old and old.get('hash') == content_hash:
+                    new_summaries[directory] = old
+                elif len(parts) == 1:
+                    new_summaries[directory] = {'hash': content_hash, 'summary': parts[0][1]}
+                else:
+                    to_summarize[directory] = (content_hash,
+                                               truncate_to_budget(content, DIRECTORY_SUMMARY_INPUT_TOKENS, model_name))
+
+            if not to_summarize:
+                continue
+            with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+                futures = {executor.submit(summarize_directory, directory or self.name, content, models, use_cache):
+                           directory for directory, (_, content) in to_summarize.items()}
+                for future in as_completed(futures):
+                    directory = futures[future]
+                    try:
+                        new_summaries[directory] = {'hash': to_summarize[directory][0], 'summary': future.result()}
+                        summarized += 1
+                    except Exception as e:
+                        print(f"Error summarizing directory {directory or '.'}: {e}")
+                        # Keep the previous summary without hash, so the directory is retried on the next refresh
+                        old_summary = old_summaries.get(directory, {}).get('summary')
+                        if old_summary is not None:
+                            new_summaries[directory] = {'hash': None, 'summary': old_summary}
+
+        message = f"Summarized {summarized} of {len(tree)} directories."
+        print(message)
+        if socketio is not None and summarized:
+            socketio.emit('script_output', {'data': message})
+
+        self.directory_summaries = json.dumps(new_summaries)
+
+    def overview_summary(self, max_depth=1):
+        """Summaries of the root and the directories up to `max_depth` levels deep, the compact top of the tree."""
+        directory_summaries = json.loads(self.directory_summaries or '{}')
+        result = []
+        for directory in sorted(directory_summaries, key=lambda d: (d.count('/') if d else -1, d)):
+            if directory and directory.count('/') >= max_depth:
+                continue
+            summary = directory_summaries[directory].get('summary')
+            if summary is not None:
+                result.append(f"Directory: {directory or '.'}/\nSummary of directory: {summary}\n")
+        return "\n".join(result)
+
+    @staticmethod
+    def _summarize_files(contents, models, socketio=None, max_workers=SUMMARY_MAX_WORKERS, use_cache=True):
+        """
+        Summarize files concurrently, with at most `max_workers` LLM calls in flight.
+
+        `contents` maps (relative) paths to file contents. Returns a dict mapping every path to a (summary, error)
+        tuple.
+        A failing file is recorded with its error message and does not stop the rest of the batch.
+        """
+        paths = sorted(contents)
+        results = {}
+        total = len(paths)
+        if not total:
+            return results
+
+        start_time = time.time()
+        last_report = 0
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {executor.submit(summarize, contents[path], models, use_cache): path for path in paths}
+
+            for done, future in enumerate(as_completed(futures), start=1):
+                path = futures[future]
+                try:
+                    results[path] = (future.result(), None)
+                except Exception as e:
+                    print(f"Error summarizing {path}: {e}")
+                    results[path] = (None, str(e))
+
+                # Report progress with a rough estimate of the remaining time (at most every 2 seconds)
+                now = time.time()
+                if now - last_report >= 2 or done == total:
+                    last_report = now
+                    eta = (now - start_time) / done * (total - done)
+                    message = f"Summarized {done}/{total} files (ETA: {int(eta)}s)"
+                    print(message)
+                    if socketio is not None:
+                        socketio.emit('script_output', {'data': message})
+
+        failed = [path for path in paths if results[path][1] is not None]
+        if failed and socketio is not None:
+            socketio.emit('script_output', {'data': f"Failed to summarize {len(failed)} file(s): "
+                                                    f"{', '.join(os.path.basename(p) for p in failed)}"})
+
+        if use_cache:
+            stats = get_response_cache().stats()
+            print(f"Response cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries.")
+
+        return results
+
+    def relevant_context(self, query, models, summary_tokens=RELEVANT_CODE_SUMMARY_TOKENS,
+                         folder_tokens=RELEVANT_CODE_FOLDER_TOKENS, top_k=RELEVANT_CODE_TOP_K):
+        """
+        Return the folder structure and file summaries to determine the relevant files for `query`, bounded to a
+        token budget. On large codebases only the file summaries most similar to the query are included.
+        """
+        model_name = models['simple_task_model']
+
+        if self.summary_manifest:
+            file_summaries = [(rel_path, entry['summary'])
+                              for rel_path, entry in json.loads(self.summary_manifest).items()
+                              if entry.get('summary') is not None]
+        else:
+            file_summaries = list(self._parse_legacy_summary().items())
+
+        # The top of the summary tree comes first (using at most a quarter of the budget), then the files
+        overview = truncate_to_budget(self.overview_summary(), summary_tokens // 4, model_name)
+        file_tokens = summary_tokens - count_tokens(overview, model_name)
+
+        documents = [(rel_path, f"File: {os.path.basename(rel_path)}\nSummary of file: {file_summary}\n")
+                     for rel_path, file_summary in file_summaries]
+        selected = select_within_budget(query, documents, file_tokens, model_name, top_k=top_k,
+                                        embeddings=get_embeddings(api_key=models.get('openai_api_key')))
+        if len(selected) < len(documents):
+            print(f"Selected {len(selected)} of {len(documents)} file summaries for the prompt.")
+
+        folder_structure = truncate_to_budget(self.folder_structure or "", folder_tokens, model_name)
+        texts = [text for _, text in selected]
+        if overview:
+            texts.insert(0, overview)
+        return folder_structure, "\n".join(texts)
+
+    def describe_application(self, models, use_cache=True):
+        # Describe from the top of the summary tree, so the prompt doesn't grow with the number of files
+        summary = self.overview_summary() or self.summary
+        folder_structure = truncate_to_budget(self.folder_structure or "", RELEVANT_CODE_FOLDER_TOKENS,
+                                              models['simple_task_model'])
+        self.description = describe_application(summary, folder_structure, models, use_cache=use_cache)
         return self.description
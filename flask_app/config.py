@@ -9,4 +9,54 @@ CONFIG_PATH = os.path.join(FLASK_APP_DIR, 'config.ini')
 STATIC_PATH = os.path.join(FLASK_APP_DIR, 'static')
 TEMPLATE_PATH = os.path.join(FLASK_APP_DIR, 'templates')
 DATABASE_PATH = os.path.join(FLASK_APP_DIR, 'db')
+DATABASE_NAME = 'database.db'
 IGNORE_PATH = os.path.join(FLASK_APP_DIR, 'ignore.json')
+
+# Maximum number of files summarized concurrently
+SUMMARY_MAX_WORKERS = 8
+
+# Maximum number of instruction steps for which code is generated concurrently
+CODE_GENERATION_MAX_WORKERS = 5
+
+# Persistent cache for embeddings (keyed by model and text hash)
+EMBEDDING_CACHE_PATH = os.path.join(DATABASE_PATH, 'embedding_cache.db')
+EMBEDDING_CACHE_MAX_ENTRIES = 500000
+
+# Persistent cache for responses of deterministic prompts (summaries, description, relevant files), stored in
+# the application database
+RESPONSE_CACHE_PATH = os.path.join(DATABASE_PATH, DATABASE_NAME)
+RESPONSE_CACHE_MAX_ENTRIES = 50000
+RESPONSE_CACHE_TTL_SECONDS = 30 * 24 * 3600
+
+# Maximum number of tokens of child summaries combined into one directory summary
+DIRECTORY_SUMMARY_INPUT_TOKENS = 8000
+
+# Token budgets of the prompt that determines the relevant files: the file summaries most similar to the user story
+# (at most RELEVANT_CODE_TOP_K) and the folder structure are packed into these budgets
+RELEVANT_CODE_SUMMARY_TOKENS = 8000
+RELEVANT_CODE_FOLDER_TOKENS = 2000
+RELEVANT_CODE_TOP_K = 50
+
+# Connection pool settings shared by the LLM, embedding and vector database clients
+HTTP_POOL_SIZE = 20
+HTTP_KEEPALIVE_SECONDS = 60
+
+# Number of user stories that can run at the same time (one per project)
+JOB_MAX_WORKERS = 4
+
+# Time a job waits for feedback from the user (refinement answers, git and result choices) before it is interrupted
+FEEDBACK_TIMEOUT_SECONDS = 60 * 60
+
+# Number of retries (with exponential backoff) of a pipeline stage after a transient error
+STAGE_RETRIES = 3
+
+# Number of user stories listed per page in the backlog of a project
+USER_STORY_PAGE_SIZE = 50
+
+# Issues requested per page (Jira caps this at 100) and stored per batch when importing stories from Jira
+JIRA_IMPORT_PAGE_SIZE = 100
+
+# Timeout of a single Jira request, retries of a queued Jira update, and the maximum length of a combined comment
+JIRA_TIMEOUT_SECONDS = 30
+JIRA_OUTBOX_RETRIES = 5
+JIRA_COMMENT_MAX_CHARS = 32000
@@ -0,0 +1,33 @@
+import uuid
+import datetime
+
+from sqlalchemy import Column, String, DateTime
+
+from codebase.codebase_class import Base
+
+
+class Job(Base):
+    __tablename__ = 'jobs'
+
+    id = Column(String, primary_key=True)
+    project_name = Column(String)
+    user_id = Column(String)
+    jira_id = Column(String)
+    user_story = Column(String)
+    status = Column(String, index=True)
+    error = Column(String)
+    created_at = Column(DateTime)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    def __init__(self, project_name, user_id, jira_id, user_story):
+        self.id = uuid.uuid4().hex
+        self.project_name = project_name
+        self.user_id = user_id
+        self.jira_id = jira_id
+        self.user_story = user_story
+        self.status = "queued"
+        self.error = None
+        self.created_at = datetime.datetime.now()
+        self.started_at = None
+        self.finished_at = None
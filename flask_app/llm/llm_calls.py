@@ -1,62 +1,118 @@
 import re
 import os
-import threading
-
-from flask_socketio import SocketIO, emit
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from . import prompts
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import PromptTemplate
 from langchain_core.runnables import RunnablePassthrough
-from langchain_openai import ChatOpenAI
 
-socketio = SocketIO()
-# Global state to track the refinement process for each user
-global refinement_state
-refinement_state = {}
-feedback_received = threading.Event()
+from config import CODE_GENERATION_MAX_WORKERS
+from utils.client_registry import get_chat_model
+from utils.response_cache import cached_invoke
 
 
-def summarize(content, models):
-    # Initialize API call
-    model = ChatOpenAI(temperature=0,
-                       model_name=models['simple_task_model'],
-                       request_timeout=120)
+class TokenStreamer:
+    """
+    Forwards streamed LLM tokens to the client over the 'script_stream' socket event. Tokens are coalesced and
+    emitted at most every `interval` seconds (or once `max_chars` characters are buffered).
+    """
+
+    def __init__(self, socketio, stream_id, interval=0.25, max_chars=500):
+        self.socketio = socketio
+        self.stream_id = stream_id
+        self.interval = interval
+        self.max_chars = max_chars
+        self.buffer = []
+        self.buffered_chars = 0
+        # Emit the first token right away, so feedback starts as soon as the model does
+        self.last_emit = 0
+
+    def add(self, text):
+        if not text:
+            return
+        self.buffer.append(text)
+        self.buffered_chars += len(text)
+        if self.buffered_chars >= self.max_chars or time.time() - self.last_emit >= self.interval:
+            self.flush()
+
+    def flush(self, done=False):
+        if self.buffer or done:
+            self.socketio.emit('script_stream', {'stream_id': self.stream_id, 'data': ''.join(self.buffer),
+                                                 'done': done})
+            self.buffer = []
+            self.buffered_chars = 0
+            self.last_emit = time.time()
+
+
+def run_chain(chain, inputs, socketio=None, stream_id=None):
+    """Invoke the chain and return the content; with a socketio given, stream the tokens to the client as well."""
+    if socketio is None:
+        return chain.invoke(inputs).content
+
+    streamer = TokenStreamer(socketio, stream_id)
+    parts = []
+    try:
+        for chunk in chain.stream(inputs):
+            parts.append(chunk.content)
+            streamer.add(chunk.content)
+    finally:
+        streamer.flush(done=True)
+    return ''.join(parts)
+
+
+def summarize(content, models, use_cache=True):
+    # Initialize API call (responses are cached, as the prompt is deterministic)
+    params = dict(temperature=0, model_name=models['simple_task_model'])
+    model = get_chat_model(api_key=models.get('openai_api_key'), request_timeout=120, **params)
     prompt = PromptTemplate(template=prompts.summarize_prompt, input_variables=["content"])
     chain = prompt | model
 
     # Run
-    summary = chain.invoke({"content": content})
+    summary = cached_invoke('summarize_prompt', prompts.summarize_prompt, params, chain, {"content": content},
+                            use_cache=use_cache)
+
+    return summary
+
+
+def summarize_directory(directory, content, models, use_cache=True):
+    # Initialize API call (combines the summaries of a directory's files and subdirectories)
+    params = dict(temperature=0, model_name=models['simple_task_model'])
+    model = get_chat_model(api_key=models.get('openai_api_key'), request_timeout=120, **params)
+    prompt = PromptTemplate(template=prompts.directory_summary_prompt, input_variables=["directory", "content"])
+    chain = prompt | model
+
+    # Run
+    summary = cached_invoke('directory_summary_prompt', prompts.directory_summary_prompt, params, chain,
+                            {"directory": directory, "content": content}, use_cache=use_cache)
 
-    return summary.content
+    return summary
 
 
-def describe_application(summary, folder_structure, models):
+def describe_application(summary, folder_structure, models, use_cache=True):
     print("Generating short description of the application..")
 
     # Initialize the API call
-    model = ChatOpenAI(temperature=0,
-                       model_name=models['simple_task_model'],
-                       request_timeout=120,
-                       top_p=0.1)
+    params = dict(temperature=0, model_name=models['simple_task_model'], top_p=0.1)
+    model = get_chat_model(api_key=models.get('openai_api_key'), request_timeout=120, **params)
     prompt = PromptTemplate(template=prompts.description_prompt, input_variables=["summary", "folder_structure"])
     chain = prompt | model
 
     # Get result
-    result = chain.invoke({"summary": summary, "folder_structure": folder_structure})
+    result = cached_invoke('description_prompt', prompts.description_prompt, params, chain,
+                           {"summary": summary, "folder_structure": folder_structure}, use_cache=use_cache)
 
-    return result.content
+    return result
 
 
-def relevant_code(original_story: str, updated_story: str, folder_structure: str, summary: str, models: dict) -> str:
+def relevant_code(original_story: str, updated_story: str, folder_structure: str, summary: str, models: dict,
+                  use_cache: bool = True) -> str:
     print("Determining which code files are relevant..")
 
     # Initialize API call
-    model = ChatOpenAI(temperature=0,
-                       model_name=models['simple_task_model'],
-                       request_timeout=120,
-                       max_tokens=100,
-                       top_p=0.05)
+    params = dict(temperature=0, model_name=models['simple_task_model'], max_tokens=100, top_p=0.05)
+    model = get_chat_model(api_key=models.get('openai_api_key'), request_timeout=120, **params)
     prompt = PromptTemplate(template=prompts.relevant_code_prompt, input_variables=["original_story",
                                                                                     "updated_story",
                                                                                     "folder_structure",
@@ -64,51 +120,55 @@ def relevant_code(original_story: str, updated_story: str, folder_structure: str
     chain = prompt | model
 
     # Run
-    result = chain.invoke({"original_story": original_story,
-                           "updated_story": updated_story,
-                           "folder_structure": folder_structure,
-                           "summary": summary})
+    result = cached_invoke('relevant_code_prompt', prompts.relevant_code_prompt, params, chain,
+                           {"original_story": original_story,
+                            "updated_story": updated_story,
+                            "folder_structure": folder_structure,
+                            "summary": summary}, use_cache=use_cache)
 
-    return result.content
+    return result
 
 
-def generate_instructions(vectordb, updated_story: str, code_needed: str, models: dict) -> str:
+def generate_instructions(vectordb, updated_story: str, code_needed: str, models: dict, socketio=None,
+                          symbol_index=None) -> str:
     print("Generating instructions..")
-    code_str = vectordb.search_vectordb(code_needed)
+    code_str = vectordb.search_vectordb(code_needed, symbol_index=symbol_index)
 
     # Initialize API call
-    model = ChatOpenAI(temperature=0,
-                       model_name=models['hard_task_model'],
-                       request_timeout=120,
-                       stop="Step 6",
-                       top_p=0.05)
+    model = get_chat_model(api_key=models.get('openai_api_key'),
+                           temperature=0,
+                           model_name=models['hard_task_model'],
+                           request_timeout=120,
+                           stop="Step 6",
+                           top_p=0.05)
     prompt = PromptTemplate(template=prompts.instructions_prompt, input_variables=["updated_story", "code_str"])
     chain = prompt | model
 
     # Run
-    instructions = chain.invoke({"updated_story": updated_story, "code_str": code_str})
+    instructions = run_chain(chain, {"updated_story": updated_story, "code_str": code_str},
+                             socketio=socketio, stream_id='instructions')
 
-    return instructions.content
+    return instructions
 
 
-def generate_code(vectordb, instructions: str, updated_story: str, models: dict) -> str:
+def generate_code(vectordb, instructions: str, updated_story: str, models: dict, socketio=None,
+                  max_workers=CODE_GENERATION_MAX_WORKERS, symbol_index=None) -> str:
     print("Generating code changes based on instructions..")
 
     # Initialize API call
-    model = ChatOpenAI(temperature=0,
-                       model_name=models['hard_task_model'],
-                       request_timeout=120,
-                       top_p=0.05)
+    model = get_chat_model(api_key=models.get('openai_api_key'),
+                           temperature=0,
+                           model_name=models['hard_task_model'],
+                           request_timeout=120,
+                           top_p=0.05)
     prompt = PromptTemplate(template=prompts.code_prompt, input_variables=["updated_story", "instructions", "step",
                                                                            "code_str"])
     chain = prompt | model
 
     # Define remaining variables for input in prompt (other two are input in calling the function)
     instructions_split = re.split('\n\n', instructions.strip())
-    track_list = ""
 
-    # Loop over different steps in instructions and run agent for every step
-    for i, step in enumerate(instructions_split):
+    def generate_step(i, step):
         # Find part(s) of the code to use and update
         lines = step.strip().split('\n')
         file_line = lines[1]
@@ -116,15 +176,22 @@ def generate_code(vectordb, instructions: str, updated_story: str, models: dict)
         file_path = file_line.split("File: ", 1)[-1]
         file_name = os.path.basename(file_path)
 
-        if file_name:
-            code_str = vectordb.retrieve_embeddings(search_query, k=1, file=file_name)
-        else:
-            code_str = vectordb.retrieve_embeddings(search_query, k=1)
+        def find_code(query, file=None):
+            # Code constructs named in the step are read from disk; only a miss needs a vector search
+            if symbol_index is not None:
+                docs = symbol_index.find_docs(query, file=file)
+                if docs:
+                    return vectordb.format_docs(docs)
+            if file:
+                return vectordb.retrieve_embeddings(query, k=1, file=file)
+            return vectordb.retrieve_embeddings(query, k=1)
+
+        code_str = find_code(search_query, file_name or None)
 
         # Getting another possible relevant part of code based on instruction
         if len(lines) > 3:
             second_search_query = '\n'.join(lines[3:])
-            vdb_two = vectordb.retrieve_embeddings(second_search_query, k=1)
+            vdb_two = find_code(second_search_query)
             if vdb_two and vdb_two != code_str:
                 code_str += vdb_two
 
@@ -135,44 +202,45 @@ def generate_code(vectordb, instructions: str, updated_story: str, models: dict)
             code_str = code_str[: -len(part_to_remove)]
 
         # Run agent
-        result = chain.invoke({"updated_story": updated_story, "instructions": instructions,
-                               "step": i + 1, "code_str": code_str})
+        return run_chain(chain, {"updated_story": updated_story, "instructions": instructions,
+                                 "step": i + 1, "code_str": code_str},
+                         socketio=socketio, stream_id=f'code-step-{i + 1}')
 
-        # Combine code changes from all steps
-        track_list += result.content + "\n\n"
+    # Steps only share the instructions as input, so retrieval and generation run concurrently per step
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(instructions_split)))) as executor:
+        results = list(executor.map(generate_step, range(len(instructions_split)), instructions_split))
+
+    # Combine code changes from all steps, in step order
+    track_list = "".join(result + "\n\n" for result in results)
 
     # Sanity check generated code steps
     refine_prompt = PromptTemplate(template=prompts.refine_prompt, input_variables=["updated_story", "track_list"])
     refine_chain = refine_prompt | model
 
     print("Reviewing suggested code changes..")
-    revised_result = refine_chain.invoke({"updated_story": updated_story, "track_list": track_list})
+    revised_result = run_chain(refine_chain, {"updated_story": updated_story, "track_list": track_list},
+                               socketio=socketio, stream_id='code-review')
     print("Code changes are ready for review..")
-    return revised_result.content
+    return revised_result
 
 
-def refine_user_story(original_story, codebase_description, user_id, models):
+def refine_user_story(original_story, codebase_description, models, socketio, wait_for_feedback, max_iterations=3):
     """
-    Initiates the user-story refinement process.
+    Runs the user-story refinement process: proposes acceptance criteria and revises them based on the user's
+    feedback, until the user agrees or `max_iterations` rounds of feedback have been given.
 
     Parameters:
     original_story (str): The original user story description.
     codebase_description (str): A short description of the application's current state
-    user_id (str): Unique identifier for the user's session.
     models (dict): Models used for processing.
+    socketio: Used to emit messages to the client (e.g. a JobSocket).
+    wait_for_feedback (callable): Blocks until the user responds and returns the response.
     """
-    # Initialize the refinement process
-    refinement_state[user_id] = {
-        "user_story": original_story,
-        "feedback_iterations": 0,
-        "models": models,
-        "current_response": None
-    }
-
-    model = ChatOpenAI(temperature=0,
-                       model_name=models['simple_task_model'],
-                       request_timeout=120,
-                       top_p=0.05)
+    model = get_chat_model(api_key=models.get('openai_api_key'),
+                           temperature=0,
+                           model_name=models['simple_task_model'],
+                           request_timeout=120,
+                           top_p=0.05)
     model_parser = model | StrOutputParser()
     first_prompt_template = PromptTemplate(template=prompts.acceptance_criteria_start, input_variables=["description",
                                                                                                         "user_story"])
@@ -184,18 +252,31 @@ def refine_user_story(original_story, codebase_description, user_id, models):
     )
 
     first_run_response_dict = chain_1.invoke({"description": codebase_description, "user_story": original_story})
-    first_run_response = first_run_response_dict[next(iter(first_run_response_dict))]
-    refinement_state[user_id]["current_response"] = first_run_response
-    emit('script_output', {'data': f"To realize this user-story I will use these acceptance criteria: "
-                                   f"\n\n{first_run_response}"})
-    emit('script_output', {'data': "..."})
-    emit('request_user_story_feedback', {'message': "Please respond whether you agree with this (yes/y), or provide "
-                                                    "feedback to specify your wishes:"})
-    feedback_received.wait()
-
-    # Function resumes here - clean-up and return result
-    result = refinement_state[user_id]["current_response"]
-    split_result = result.split('riteria:\n')
+    current_response = first_run_response_dict[next(iter(first_run_response_dict))]
+    socketio.emit('script_output', {'data': f"To realize this user-story I will use these acceptance criteria: "
+                                            f"\n\n{current_response}"})
+    socketio.emit('script_output', {'data': "..."})
+
+    for feedback_iterations in range(1, max_iterations + 1):
+        socketio.emit('request_user_story_feedback', {'message': "Please respond whether you agree with this "
+                                                                 "(yes/y), or provide feedback to specify your "
+                                                                 "wishes:"})
+        feedback = wait_for_feedback()
+
+        if feedback.lower() in ['yes', 'y', 'yeah', 'yep']:
+            socketio.emit('script_output', {'data': "Great! I will start working on this."})
+            break
+        if feedback_iterations == max_iterations:
+            socketio.emit('script_output', {'data': f"Reached the maximum of {max_iterations} user-story "
+                                                    f"refinements. Will start developing."})
+            break
+
+        current_response = refine_user_story_iteration(original_story, current_response, models, feedback)
+        socketio.emit('script_output', {'data': f"After considering your feedback, I revised the acceptance "
+                                                f"criteria like this:\n\n{current_response}"})
+
+    # Clean-up and return result
+    split_result = current_response.split('riteria:\n')
 
     if len(split_result) > 1:
         cleaned_result = split_result[1]
@@ -203,18 +284,15 @@ def refine_user_story(original_story, codebase_description, user_id, models):
         # Handle the case where 'riteria:\n' is not found in the string
         cleaned_result = split_result[0]
 
-    del refinement_state[user_id]
-
     return cleaned_result
 
 
-def refine_user_story_iteration(original_story, user_id, models, user_response):
-    feedback_received.clear()
-
-    model = ChatOpenAI(temperature=0,
-                       model_name=models['simple_task_model'],
-                       request_timeout=120,
-                       top_p=0.05)
+def refine_user_story_iteration(original_story, current_response, models, user_response):
+    model = get_chat_model(api_key=models.get('openai_api_key'),
+                           temperature=0,
+                           model_name=models['simple_task_model'],
+                           request_timeout=120,
+                           top_p=0.05)
     model_parser = model | StrOutputParser()
 
     second_prompt_template = PromptTemplate(template=prompts.acceptance_criteria_iterate,
@@ -228,18 +306,8 @@ def refine_user_story_iteration(original_story, user_id, models, user_response):
 
     second_run_response_dict = chain_2.invoke({
         "user_story": original_story,
-        "first_run_response": refinement_state[user_id]["current_response"],
+        "first_run_response": current_response,
         "user_response": user_response
     })
 
-    second_run_response = second_run_response_dict[next(iter(second_run_response_dict))]
-    refinement_state[user_id]["current_response"] = second_run_response
-    refinement_state[user_id]["feedback_iterations"] += 1
-    emit('script_output', {'data': f"After considering your feedback, I revised the acceptance criteria like "
-                                   f"this:\n\n{second_run_response}"})
-    emit('request_user_story_feedback', {'message': "Please respond whether you agree with this (yes/y), or provide "
-                                                    "feedback to specify your wishes:"})
-
-
-def finalize_feedback():
-    feedback_received.set()
+    return second_run_response_dict[next(iter(second_run_response_dict))]
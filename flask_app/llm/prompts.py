@@ -5,6 +5,14 @@ What are the main classes/functions for? How could this file be used in the work
 The code to describe/summarize (keep it as short as possible):
 {content}"""
 
+directory_summary_prompt = """You are an expert software developer, who summarizes code.
+Below are summaries of the files and subdirectories of the directory '{directory}' in an application's codebase.
+Give a brief summary of the functionality of this directory as a whole. What part of the application does it implement?
+How do its files and subdirectories work together?
+
+The summaries to combine (keep it as short as possible):
+{content}"""
+
 description_prompt = """Act as an expert software developer, who is in charge of developing an application's codebase.
 Your current task is to briefly describe what application we are dealing with.
 Refrain from describing the files, just describe the overall functionality of the entire application.
@@ -12,7 +20,7 @@ Refrain from describing the files, just describe the overall functionality of th
 This is the folder structure of the application's codebase:
 {folder_structure}
 
-These are short summaries of all the (relevant) files:
+These are short summaries of the application and its main directories:
 {summary}"""
 
 acceptance_criteria_start = """Understanding and Verification:
@@ -77,7 +85,7 @@ These are the acceptance criteria to realize this new functionality:
 The application's codebase is structured like this:
 {folder_structure}
 
-These are summaries of all the files of the codebase:
+These are summaries of the codebase's main directories and of its files (the files most related to the new functionality):
 {summary}
 [END OF SUMMARIES]
 
@@ -1,14 +1,16 @@
 import os
-import configparser
+import atexit
 from flask import Flask, render_template, request, redirect, url_for, session
 from flask_socketio import SocketIO
 
 import create_project as create_project
 import open_project as open_project
 import setup_application as setup_application
-from utils.git_manager import GitManager
 from utils.database_manager import DatabaseManager
-from config import STATIC_PATH, TEMPLATE_PATH, CONFIG_PATH, DATABASE_PATH
+from utils.job_manager import JobManager
+from utils.jira_outbox import JiraOutbox
+from utils.settings import SettingsService
+from config import STATIC_PATH, TEMPLATE_PATH, CONFIG_PATH, DATABASE_PATH, DATABASE_NAME
 
 app = Flask(__name__,
             static_folder=STATIC_PATH,
@@ -18,15 +20,23 @@ app.secret_key = 'supersecretkey'
 
 socketio = SocketIO(app, cors_allowed_origins='*')
 
-# GitManager
-app.git_manager = GitManager()
-
 # DatabaseManager
 if not os.path.exists(DATABASE_PATH):
     os.makedirs(DATABASE_PATH)
-app.db_manager = DatabaseManager('database.db', DATABASE_PATH)
+app.db_manager = DatabaseManager(DATABASE_NAME, DATABASE_PATH)
 app.db_manager.init_db()
 
+# SettingsService (config.ini, parsed once and again only when it changes)
+app.settings = SettingsService(CONFIG_PATH)
+
+# JiraOutbox (sends Jira updates in the background; pending updates get a few seconds to go out on shutdown)
+app.jira_outbox = JiraOutbox()
+atexit.register(app.jira_outbox.flush, 10)
+
+# JobManager (runs user stories in the background)
+app.job_manager = JobManager(app, socketio)
+app.job_manager.recover()
+
 # Register blueprints
 app.register_blueprint(setup_application.setup_bp)
 app.register_blueprint(create_project.create_project_bp)
@@ -36,15 +46,8 @@ app.register_blueprint(open_project.open_project_bp)
 users = {"test_user": "12345"}
 
 
-def get_config():
-    config = configparser.ConfigParser()
-    config.read(CONFIG_PATH)
-    return config
-
-
 def is_login_disabled():
-    config = get_config()
-    return config.getboolean('DEFAULT', 'disable_login', fallback=True)
+    return app.settings.get().disable_login
 
 
 @app.route('/')
@@ -57,7 +60,7 @@ def index():
 @app.route('/main')
 def main():
     try:
-        with app.db_manager.session_scope() as db_session:
+        with app.db_manager.read_session() as db_session:
             project_names = app.db_manager.get_all_project_names(db_session)
     except Exception:
         project_names = []
@@ -97,7 +100,12 @@ def handle_create_project(json):
 
 @socketio.on('add_user_story')
 def handle_add_user_story(json):
-    open_project.handle_add_user_story(json)
+    return open_project.handle_add_user_story(json)
+
+
+@socketio.on('list_user_stories')
+def handle_list_user_stories(json):
+    open_project.handle_list_user_stories(json, socketio, request.sid)
 
 
 @socketio.on('delete_user_story')
@@ -107,22 +115,32 @@ def handle_delete_user_story(json):
 
 @socketio.on('jira_import')
 def handle_jira_import(json):
-    open_project.import_jira_issues(json, socketio)
+    open_project.import_jira_issues(json, socketio, request.sid)
 
 
 @socketio.on('run_story')
 def handle_run_story(json):
-    open_project.handle_run_story(json, socketio)
+    open_project.handle_run_story(json, socketio, request.sid)
+
+
+@socketio.on('resume_story')
+def handle_resume_story(json):
+    open_project.handle_run_story({**json, 'resume': True}, socketio, request.sid)
+
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    app.job_manager.cancel_client_jobs(request.sid)
 
 
 @socketio.on('git_feedback_dirty')
 def on_git_feedback_dirty(json):
-    open_project.on_git_feedback_dirty(json, socketio)
+    open_project.on_git_feedback_dirty(json)
 
 
 @socketio.on('user_story_feedback')
 def on_user_story_feedback(json):
-    open_project.on_user_story_feedback(json, socketio)
+    open_project.on_user_story_feedback(json)
 
 
 @socketio.on('user_story_result')
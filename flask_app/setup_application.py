@@ -1,5 +1,5 @@
 import configparser
-from flask import Blueprint, render_template
+from flask import Blueprint, render_template, current_app
 from config import CONFIG_PATH
 
 setup_bp = Blueprint('setup', __name__)
@@ -12,8 +12,10 @@ def setup():
 
 
 def handle_save_settings(json, socketio):
+    # Settings that are not on the form (VECTOR_BACKEND, models, disable_login) keep their current value
     config = configparser.ConfigParser()
-    config['DEFAULT'] = {
+    config.read(CONFIG_PATH)
+    config['DEFAULT'].update({
         'OPENAI_API_KEY': json['openai_api_key'],
         'PINECONE_API_KEY': json['pinecone_api_key'],
         'JIRA_URL': json.get('jira_base_url', ''),
@@ -21,7 +23,7 @@ def handle_save_settings(json, socketio):
         'JIRA_PASSWORD': json.get('jira_token', ''),
         'LANGCHAIN_API_KEY': json.get('langchain_api_key', ''),
         'LANGCHAIN_PROJECT': json.get('langchain_project', '')
-    }
+    })
 
     # Set Langchain tracing to true if API key is provided
     if json.get('langchain_api_key'):
@@ -31,6 +33,7 @@ def handle_save_settings(json, socketio):
 
     with open(CONFIG_PATH, 'w') as config_file:
         config.write(config_file)
+    current_app.settings.invalidate()
 
     # Emit a response back to the client
     socketio.emit('settings_saved', {'message': 'Configuration saved successfully'})
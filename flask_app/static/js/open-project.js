@@ -18,6 +18,8 @@ document.addEventListener('DOMContentLoaded', (event) => {
     // Initialize drag and drop
     let storyCount = document.querySelectorAll('#backlog div[draggable="true"]').length;
     let isDropAllowed = true;
+    let currentJobId = null;  // Background job running the dropped user story
+    let lastRunPayload = null;  // Payload of the last run, used to resume it after a failure
     initializeDragAndDrop();
 
     // Initialize new user story input field
@@ -26,6 +28,12 @@ document.addEventListener('DOMContentLoaded', (event) => {
     // Handle jira-button click
     document.getElementById('jira-button').onclick = () => socket.emit('jira_import', { project_name: project_name });
 
+    // The backlog is loaded one page at a time (the first page is rendered with the page); every next page starts
+    // after the id of the last story loaded so far
+    const loadMoreButton = document.getElementById('load-more-stories');
+    let lastStoryId = parseInt(loadMoreButton.dataset.lastStoryId, 10) || 0;
+    loadMoreButton.onclick = () => socket.emit('list_user_stories', { project_name: project_name, after_id: lastStoryId });
+
     // Functions
     function initializeDragAndDrop() {
         draggableContainer.addEventListener('dragover', handleDragOver);
@@ -62,7 +70,8 @@ document.addEventListener('DOMContentLoaded', (event) => {
         running.innerHTML = '';
         running.appendChild(outputDiv);
 
-        socket.emit('run_story', { user_id, project_name, jira_id: jira_id, user_story: data});
+        lastRunPayload = { user_id, project_name, jira_id: jira_id, user_story: data };
+        socket.emit('run_story', lastRunPayload);
     }
 
     function makeBacklogItemsDraggable() {
@@ -130,13 +139,43 @@ document.addEventListener('DOMContentLoaded', (event) => {
         const newStoryDiv = createStoryElement(storyText, storyCount, jiraID);
         backlog.appendChild(newStoryDiv);
 
-        socket.emit('add_user_story', { story: storyText, projectName: project_name, jiraID: jiraID });
+        // The server acknowledges with the id of the new story, so a later page won't show it a second time
+        socket.emit('add_user_story', { story: storyText, projectName: project_name, jiraID: jiraID },
+                    (storyId) => { newStoryDiv.setAttribute('data-story-id', storyId); });
+    }
+
+    // Function for appending a batch of imported Jira stories (already stored by the server)
+    function handleJiraStories(data) {
+        const fragment = document.createDocumentFragment();
+        data.stories.forEach((story) => {
+            storyCount++;
+            fragment.appendChild(createStoryElement(story.summary, storyCount, story.jira_id, story.id));
+        });
+        backlog.appendChild(fragment);
+    }
+
+    // Function for appending a page of user stories requested with 'list_user_stories'
+    function handleUserStoriesPage(data) {
+        data.stories.forEach((story) => {
+            // Stories added or imported while this page is open are already shown
+            if (!backlog.querySelector(`div[data-story-id="${story.id}"]`)) {
+                storyCount++;
+                backlog.appendChild(createStoryElement(story.text, storyCount, story.jira_id, story.id));
+            }
+        });
+        if (data.stories.length) {
+            lastStoryId = data.stories[data.stories.length - 1].id;
+        }
+        loadMoreButton.style.display = data.has_more ? 'block' : 'none';
     }
 
-    function createStoryElement(text, id, jiraID) {
+    function createStoryElement(text, id, jiraID, storyID) {
         const div = document.createElement('div');
         div.id = 'story' + id;
         div.setAttribute('data-jira-id', jiraID);
+        if (storyID !== undefined) {
+            div.setAttribute('data-story-id', storyID);
+        }
         div.className = 'bg-gray-700 p-2 rounded';
         div.setAttribute('draggable', 'true');
         div.textContent = text;
@@ -147,15 +186,34 @@ document.addEventListener('DOMContentLoaded', (event) => {
 
     // Function to redirect socket events to the right function
     function initializeSocketEvents() {
+        socket.on('job_started', (data) => { currentJobId = data.job_id; });
         socket.on('enable_drop_object', () => { isDropAllowed = true; });
+        socket.on('job_failed', handleJobFailed);
         socket.on('request_git_feedback_dirty', handleGitFeedbackDirty);
         socket.on('request_user_story_feedback', handleUserStoryRefinementFeedback);
         socket.on('user_story_done', handleUserStoryDone);
-        socket.on('add_jira_story', (data) => { addNewUserStory(data.summary, data.jira_id) });
+        socket.on('add_jira_stories', handleJiraStories);
+        socket.on('user_stories_page', handleUserStoriesPage);
         socket.on('script_output', (data) => {
             let formattedText = formatText(data.data);
             outputDiv.innerHTML += `<div>${formattedText}</div>`;
         });
+        socket.on('script_stream', handleScriptStream);
+    }
+
+    // Function for appending streamed LLM output, one element per stream
+    function handleScriptStream(data) {
+        let streamDiv = outputDiv.querySelector(`div[data-stream-id="${data.stream_id}"]:not([data-done])`);
+        if (!streamDiv) {
+            streamDiv = document.createElement('div');
+            streamDiv.setAttribute('data-stream-id', data.stream_id);
+            streamDiv.style.whiteSpace = 'pre-wrap';
+            outputDiv.appendChild(streamDiv);
+        }
+        streamDiv.textContent += data.data;
+        if (data.done) {
+            streamDiv.setAttribute('data-done', 'true');
+        }
     }
 
     // Function for formatting script output text
@@ -173,6 +231,7 @@ document.addEventListener('DOMContentLoaded', (event) => {
 
     // Function for handling dirty git repo
     function handleGitFeedbackDirty(data) {
+        currentJobId = data.job_id || currentJobId;
         const gitFeedbackButtons = document.getElementById('gitFeedbackButtons');
 
         if (outputDiv && gitFeedbackButtons) {
@@ -186,12 +245,13 @@ document.addEventListener('DOMContentLoaded', (event) => {
     }
 
     function handleGitFeedback(feedback) {
-        socket.emit('git_feedback_dirty', { feedback: feedback });
+        socket.emit('git_feedback_dirty', { job_id: currentJobId, feedback: feedback });
         document.getElementById('gitFeedbackButtons').style.display = 'none';  // Hide the buttons after feedback
     }
 
     // Function for getting acceptance criteria feedback
     function handleUserStoryRefinementFeedback(data) {
+        currentJobId = data.job_id || currentJobId;
         const userStoryRefinementFeedback = document.getElementById('userStoryRefinementFeedback');
 
         if (outputDiv && userStoryRefinementFeedback) {
@@ -201,7 +261,7 @@ document.addEventListener('DOMContentLoaded', (event) => {
             document.getElementById('sendFeedback').onclick = () => {
                 let feedback = document.getElementById('feedbackInput').value;
                 if (feedback.trim() !== '') {
-                    socket.emit('user_story_feedback', { user_id: user_id, feedback: feedback });
+                    socket.emit('user_story_feedback', { job_id: currentJobId, user_id: user_id, feedback: feedback });
                     document.getElementById('feedbackInput').value = '';  // Clear the input
                     userStoryRefinementFeedback.style.display = 'none';  // Hide the input and button
                 } else {
@@ -211,8 +271,16 @@ document.addEventListener('DOMContentLoaded', (event) => {
         }
     }
 
+    // Function for offering to resume a failed user story from its last completed stage
+    function handleJobFailed(data) {
+        if (lastRunPayload && confirm(`Running the user story failed: ${data.error}\n\nResume from the last completed stage?`)) {
+            socket.emit('resume_story', lastRunPayload);
+        }
+    }
+
     // Function for handling feedback on finished user story
     function handleUserStoryDone(data) {
+        currentJobId = data.job_id || currentJobId;
         const userStoryResultFeedback = document.getElementById('userStoryResultFeedback');
 
         if (outputDiv && userStoryResultFeedback) {
@@ -226,7 +294,7 @@ document.addEventListener('DOMContentLoaded', (event) => {
     }
 
     function handleUserStoryResultFeedback(feedback) {
-        socket.emit('user_story_result', { feedback: feedback });
+        socket.emit('user_story_result', { job_id: currentJobId, feedback: feedback });
         document.getElementById('userStoryResultFeedback').style.display = 'none';  // Hide the buttons after feedback
     }
 });
\ No newline at end of file
@@ -0,0 +1,300 @@
+import os
+
+from config import STAGE_RETRIES
+from userstory.userstory_class import STAGES
+
+from utils.jira_integration import JiraIntegration
+from utils.vectordb_integration import VectorDBIntegration
+from utils.symbol_index import SymbolIndex
+from utils.git_manager import GitManager
+from utils.repo_scanner import rescan_paths
+from utils.code_change_handler import implement_code_changes
+from utils.retry import call_with_retries
+
+# Stages that are redone on every normal run; the LLM stages before them are reused once they are done
+POST_GENERATION_STAGES = ('apply', 'reindex', 'resummarize')
+
+
+class StoryPipeline:
+    """
+    Runs a user story through the stages in STAGES. Every stage records its status, timestamps, attempt count and
+    last error on the UserStory and is retried with exponential backoff on transient errors (rate limits, 5xx,
+    timeouts). Stages that are done are skipped, so `run(resume=True)` continues from the last good stage.
+    Jira updates are handed to the JiraOutbox and sent in the background.
+    """
+
+    def __init__(self, json_data, socketio, channel, db_manager, settings, jira_outbox, retries=STAGE_RETRIES):
+        self.socketio = socketio
+        self.channel = channel
+        self.db_manager = db_manager
+        self.settings = settings
+        self.jira_outbox = jira_outbox
+        self.retries = retries
+
+        self.project_name = json_data['project_name']
+        self.jira_id = json_data['jira_id']
+        self.current_user_story = json_data['user_story'].strip()
+        # The model names, together with the OpenAI key every LLM call of this run uses
+        self.models = {**settings.models, 'openai_api_key': settings.openai_api_key}
+
+        self.session = None
+        self.jira = None
+        self.codebase = None
+        self.git_manager = None
+        self.vectordb = None
+        self.symbol_index = None
+        self.manifest = None
+        self.manifest_refreshed = False
+        self.user_story = None
+
+    def emit(self, message):
+        self.socketio.emit('script_output', {'data': message})
+
+    def run(self, resume=False):
+        self.emit("Started working on provided user-story..")
+
+        with self.db_manager.session_scope() as self.session:
+            try:
+                self._setup()
+
+                if not resume:
+                    self.user_story.reset_stages(POST_GENERATION_STAGES)
+
+                self._run_stage('refine', self._refine)
+                self._run_stage('relevant_files', self._relevant_files)
+                self._run_stage('instructions', self._instructions)
+                self._run_stage('code', self._code)
+                self._run_stage('apply', self._apply, retry=False)
+
+                user_story_done = self.user_story.get_stage('apply').get('outcome')
+                if user_story_done != 'implementation_failed':
+                    self._run_stage('reindex', self._reindex)
+                    self._run_stage('resummarize', self._resummarize)
+                    self._post_to_jira('move_issue', status="Done")
+
+                    if user_story_done == "implemented_successfully":
+                        self.user_story.status = "implemented_successfully"
+                    else:
+                        self.user_story.status = "implemented_manual_changes"
+
+                    self.emit('All done! You can now start running a new user story.')
+                else:
+                    self.user_story.status = "implementation_failed"
+                    self.emit('That is too bad! You can try improving the user story (e.g. make it a smaller '
+                              'functionality) and running it again. Or try running another user story.')
+                    # Possible future functionality: let user describe what was wrong and save failure-table in database
+
+                self.db_manager.update_user_story(self.session, self.user_story)
+            finally:
+                self.socketio.emit('enable_drop_object')
+                if self.git_manager is not None and self.git_manager.repo is not None:
+                    self.git_manager.remove_msg_hook()
+
+        print("Done running user story.")
+
+    ################################################################
+    # Setup connections to jira, git, database and vector database #
+    ################################################################
+
+    def _setup(self):
+        # Set JIRA integration if any
+        if self.jira_id != '':
+            self.jira = JiraIntegration(base_url=self.settings.jira_base_url,
+                                        username=self.settings.jira_username,
+                                        token=self.settings.jira_password,
+                                        project=self.project_name)
+            self._post_to_jira('move_issue', status="In Progress")
+
+        # Get codebase from database
+        self.codebase = self.db_manager.get_codebase(self.session, self.project_name, with_content=True)
+
+        # Check if git repository it is ready for code changes (has no pending changes)
+        self.git_manager = GitManager()
+        self.git_manager.set_directory(self.codebase.directory)
+        self.git_manager.handle_dirty_repo(self.socketio, lambda: self.channel.wait('git_feedback_dirty'))
+
+        # Scan the codebase once, the resulting manifest is shared by the summary and the vector index
+        manifest = self.manifest = self.codebase.scan()
+
+        # Create a summary if it doesn't exist in db
+        if not self.codebase.summary:
+            self.emit("Generating codebase summary..")
+            self.codebase.generate_summary(self.models, socketio=self.socketio, manifest=manifest)
+            self._with_retries(lambda: self.codebase.describe_application(self.models))
+            self.db_manager.add_or_update_codebase(self.session, self.codebase)
+
+        # Get or create VectorDB instance
+        self.vectordb = VectorDBIntegration(vectordb_api_key=self.settings.pinecone_api_key,
+                                            index_name=self.project_name,
+                                            backend=self.settings.vector_backend,
+                                            openai_api_key=self.settings.openai_api_key)
+
+        if not self._with_retries(self.vectordb.index_exists):
+            self.emit("Creating new vector database index..")
+            # Create a new index if it doesn't exist
+            self._with_retries(self.vectordb.create_index)
+
+        if not self._with_retries(self.vectordb.is_index_populated):
+            self.emit("Embedding and storing codebase to new index..")
+            # Embed and store codebase-directory if index is empty
+            self._with_retries(lambda: self.vectordb.embed_and_store(directory=self.codebase.directory,
+                                                                     manifest=manifest))
+
+        # Index the code constructs of the codebase, so named constructs can be read without a vector search
+        self.symbol_index = SymbolIndex(self.codebase.directory, self.vectordb.index_name)
+        self.symbol_index.update(manifest)
+
+        # Get UserStory instance from db
+        self.user_story = self.db_manager.get_user_story(self.session, self.codebase.name, self.current_user_story,
+                                                         with_content=True)
+        self.user_story.vectordb = self.vectordb
+
+    ##########
+    # Stages #
+    ##########
+
+    def _refine(self):
+        self.user_story.refine_user_story(self.codebase.description, self.models, self.socketio,
+                                          lambda: self.channel.wait('user_story_feedback'))
+
+    def _relevant_files(self):
+        # Define which code files are relevant using the summary of the current codebase
+        self.emit("Determining which code files are relevant..")
+        folder_structure, summary = self.codebase.relevant_context(
+            f"{self.user_story.original_story}\n{self.user_story.refined_story}", self.models)
+        self.user_story.relevant_code(folder_structure, summary, self.models)
+        self._post_to_jira('post_comment', f"These files seem relevant: \n{self.user_story.relevant_files}")
+
+    def _instructions(self):
+        # Generate instructions for implementing the functionality, using code from the relevant files
+        self.emit("Generating instructions..")
+        self.user_story.generate_instructions(self.models, socketio=self.socketio, symbol_index=self.symbol_index)
+        self._post_to_jira('post_comment', f"Instructions: \n{self.user_story.instructions}")
+
+    def _code(self):
+        # Generate code changes based on the instructions and relevant code, function also reviews the changes
+        self.emit("Generating code changes based on instructions..")
+        self.user_story.generate_code(self.models, socketio=self.socketio, symbol_index=self.symbol_index)
+        self._post_to_jira('post_comment', f"Generated Code: \n{self.user_story.generated_code}")
+
+    def _apply(self):
+        base_commit = self.git_manager.head_commit()
+
+        # Implement suggested code changes
+        patch = implement_code_changes(generated_code=self.user_story.generated_code, socketio=self.socketio)
+
+        # Set the commit message
+        self.git_manager.set_commit_message(summary="JORIS - automatically implemented user-story",
+                                            description=self.user_story.original_story)
+        self.git_manager.stage_changes()
+
+        # Let user know and wait for feedback
+        self.emit('Done processing the user-story..')
+        self.emit("Please review the suggested code changes in the prepared GIT commit..")
+        self.socketio.emit('user_story_done', {'data': "Let me know how it worked out.."})
+        outcome = self.channel.wait('user_story_result')
+
+        # Everything that changed since the story started, including manual edits made during the review
+        return {'outcome': outcome, 'changed_files': self._changed_files(base_commit, patch),
+                'applied': len(patch.applied), 'rejected': patch.rejected}
+
+    def _reindex(self):
+        # Update vectordb-index with the changed files of the renewed codebase
+        self.emit('Updating index in vector database..')
+        changed_paths = self._changed_paths()
+        self._refresh_manifest(changed_paths)
+        self.vectordb.sync_index(directory=self.codebase.directory, manifest=self.manifest,
+                                 relative_paths=changed_paths)
+        self.symbol_index.update(self.manifest, relative_paths=changed_paths)
+
+    def _resummarize(self):
+        # Update database with new codebase summary and new description
+        self.emit('Updating codebase summary..')
+        changed_paths = self._changed_paths()
+        self._refresh_manifest(changed_paths)
+        self.codebase.update_summary(self.models, socketio=self.socketio, manifest=self.manifest,
+                                     relative_paths=changed_paths)
+        self.codebase.describe_application(self.models)
+        self.db_manager.add_or_update_codebase(self.session, self.codebase)
+
+    ###########
+    # Helpers #
+    ###########
+
+    def _is_done(self, stage):
+        if self.user_story.get_stage(stage)['status'] == 'done':
+            return True
+
+        # Stories from before stage tracking only have their outputs
+        outputs = {'refine': self.user_story.refined_story, 'relevant_files': self.user_story.relevant_files,
+                   'instructions': self.user_story.instructions, 'code': self.user_story.generated_code}
+        return outputs.get(stage) is not None
+
+    def _changed_files(self, base_commit, patch):
+        """Created, modified and deleted files (relative paths) from the git changes and the applied patch."""
+        changed_files = self.git_manager.changed_files(since=base_commit)
+        known = set().union(*changed_files.values())
+
+        for path in patch.changed_paths:
+            relative_path = os.path.relpath(os.path.abspath(path), self.codebase.directory).replace(os.sep, '/')
+            if relative_path.startswith('../') or relative_path in known:
+                continue
+            kind = 'created' if path in patch.created_paths else 'modified'
+            changed_files[kind] = sorted(changed_files[kind] + [relative_path])
+        return changed_files
+
+    def _changed_paths(self):
+        # The changed-files set of the apply stage; None for runs from before it was recorded (full rescan)
+        changed_files = self.user_story.get_stage('apply').get('changed_files')
+        if changed_files is None:
+            return None
+        return set().union(*changed_files.values())
+
+    def _refresh_manifest(self, changed_paths):
+        # Bring the scan of the setup in line with the story's changes (once per run)
+        if self.manifest_refreshed:
+            return
+        if changed_paths is None:
+            self.manifest = self.codebase.scan()
+        else:
+            self.manifest = rescan_paths(self.manifest, changed_paths, self.codebase.ignore_matcher)
+        self.manifest_refreshed = True
+
+    def _run_stage(self, stage, fn, retry=True):
+        assert stage in STAGES
+        if self._is_done(stage):
+            return
+
+        self.user_story.start_stage(stage)
+        self.db_manager.update_user_story(self.session, self.user_story)
+
+        def on_retry(attempt, error, delay):
+            self.user_story.retry_stage(stage, error)
+            self.db_manager.update_user_story(self.session, self.user_story)
+            self.emit(f"Stage '{stage}' hit a temporary error ({error}), retrying in {int(delay)}s..")
+
+        try:
+            if retry:
+                outcome = call_with_retries(fn, retries=self.retries, on_retry=on_retry)
+            else:
+                outcome = fn()
+        except Exception as e:
+            # Store the failure before the session is rolled back, so the run can be resumed from this stage
+            self.user_story.fail_stage(stage, e)
+            self.db_manager.update_user_story(self.session, self.user_story)
+            self.emit(f"Stage '{stage}' failed. The user story can be resumed from this stage.")
+            raise
+
+        self.user_story.finish_stage(stage, **(outcome or {}))
+        self.db_manager.update_user_story(self.session, self.user_story)
+
+    def _with_retries(self, fn):
+        return call_with_retries(fn, retries=self.retries,
+                                 on_retry=lambda attempt, error, delay: self.emit(
+                                     f"Temporary error ({error}), retrying in {int(delay)}s.."))
+
+    def _post_to_jira(self, action, *args, **kwargs):
+        """Jira updates are queued on the JiraOutbox: they never wait for, or fail, the story itself."""
+        if self.jira is None:
+            return
+        self.jira_outbox.submit(self.jira, action, self.jira_id, *args, on_error=self.emit, **kwargs)
@@ -1,21 +1,36 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
-from sqlalchemy.orm import relationship
+import json
+import datetime
+
+from sqlalchemy import Column, Integer, String, ForeignKey, Index
+from sqlalchemy.orm import relationship, deferred
 
 from codebase.codebase_class import Base
 from llm.llm_calls import refine_user_story, relevant_code, generate_instructions, generate_code
 
 
+# Stages of the story pipeline, in order of execution
+STAGES = ('refine', 'relevant_files', 'instructions', 'code', 'apply', 'reindex', 'resummarize')
+
+
 class UserStory(Base):
     __tablename__ = 'user_stories'
+    __table_args__ = (
+        # Stories are looked up by text and listed by status, always within one codebase
+        Index('ix_user_stories_codebase_story', 'codebase_id', 'original_story'),
+        Index('ix_user_stories_codebase_status', 'codebase_id', 'status'),
+        Index('ix_user_stories_codebase_jira', 'codebase_id', 'jira_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     jira_id = Column(String)
     original_story = Column(String)
-    refined_story = Column(String)
-    relevant_files = Column(String)
-    instructions = Column(String)
-    generated_code = Column(String)
+    # LLM outputs are only loaded when accessed (all together, as one group), so listings don't read them
+    refined_story = deferred(Column(String), group='content')
+    relevant_files = deferred(Column(String), group='content')
+    instructions = deferred(Column(String), group='content')
+    generated_code = deferred(Column(String), group='content')
     status = Column(String)
+    stage_state = deferred(Column(String), group='content')
 
     # Define relationship with codebase
     codebase_id = Column(Integer, ForeignKey('codebases.id'))
@@ -31,19 +46,57 @@ class UserStory(Base):
         self.instructions = None
         self.generated_code = None
         self.status = "to_pick_up"
+        self.stage_state = None
 
-    def refine_user_story(self, codebase_description, user_id, models):
-        self.refined_story = refine_user_story(self.original_story, codebase_description, user_id, models)
+    def refine_user_story(self, codebase_description, models, socketio, wait_for_feedback):
+        self.refined_story = refine_user_story(self.original_story, codebase_description, models, socketio,
+                                               wait_for_feedback)
         self.status = "user_story_refined"
 
-    def relevant_code(self, folder_structure, summary, models):
-        self.relevant_files = relevant_code(self.original_story, self.refined_story, folder_structure, summary, models)
+    def relevant_code(self, folder_structure, summary, models, use_cache=True):
+        self.relevant_files = relevant_code(self.original_story, self.refined_story, folder_structure, summary, models,
+                                            use_cache=use_cache)
         self.status = "relevant_files_identified"
 
-    def generate_instructions(self, models):
-        self.instructions = generate_instructions(self.vectordb, self.refined_story, self.relevant_files, models)
+    def generate_instructions(self, models, socketio=None, symbol_index=None):
+        self.instructions = generate_instructions(self.vectordb, self.refined_story, self.relevant_files, models,
+                                                  socketio=socketio, symbol_index=symbol_index)
         self.status = "instructions_generated"
 
-    def generate_code(self, models):
-        self.generated_code = generate_code(self.vectordb, self.instructions, self.refined_story, models)
+    def generate_code(self, models, socketio=None, symbol_index=None):
+        self.generated_code = generate_code(self.vectordb, self.instructions, self.refined_story, models,
+                                            socketio=socketio, symbol_index=symbol_index)
         self.status = "code_generated"
+
+    @property
+    def stages(self):
+        """Per-stage status, timestamps, attempt count, last error and (optional) outcome, stored as JSON."""
+        return json.loads(self.stage_state) if self.stage_state else {}
+
+    def get_stage(self, stage):
+        return self.stages.get(stage, {'status': 'pending', 'attempts': 0})
+
+    def _update_stage(self, stage, **fields):
+        stages = self.stages
+        stages.setdefault(stage, {'status': 'pending', 'attempts': 0}).update(fields)
+        self.stage_state = json.dumps(stages)
+
+    def start_stage(self, stage):
+        now = datetime.datetime.now().isoformat()
+        self._update_stage(stage, status='running', started_at=now, finished_at=None, error=None,
+                           attempts=self.get_stage(stage)['attempts'] + 1)
+
+    def retry_stage(self, stage, error):
+        self._update_stage(stage, error=str(error), attempts=self.get_stage(stage)['attempts'] + 1)
+
+    def finish_stage(self, stage, **outcome):
+        self._update_stage(stage, status='done', finished_at=datetime.datetime.now().isoformat(), **outcome)
+
+    def fail_stage(self, stage, error):
+        self._update_stage(stage, status='failed', finished_at=datetime.datetime.now().isoformat(), error=str(error))
+
+    def reset_stages(self, stages):
+        current = self.stages
+        for stage in stages:
+            current.pop(stage, None)
+        self.stage_state = json.dumps(current)
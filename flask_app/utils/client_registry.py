@@ -0,0 +1,92 @@
+import os
+import threading
+
+import httpx
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from pinecone.grpc import PineconeGRPC, GRPCClientConfig
+
+from config import HTTP_POOL_SIZE, HTTP_KEEPALIVE_SECONDS
+from utils.embedding_cache import CachedEmbeddings
+
+# Process-wide clients, created on first use and shared by all threads. Clients are keyed by their parameters
+# (and API key), so every distinct configuration is only set up once and keeps its connections warm.
+_lock = threading.Lock()
+_http_client = None
+_chat_models = {}
+_embeddings = {}
+_pinecone_clients = {}
+_pinecone_indexes = {}
+
+
+def _params_key(params):
+    return tuple(sorted((name, repr(value)) for name, value in params.items()))
+
+
+def get_http_client():
+    """Shared, thread-safe HTTP connection pool for all OpenAI calls."""
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(limits=httpx.Limits(max_connections=HTTP_POOL_SIZE,
+                                                            max_keepalive_connections=HTTP_POOL_SIZE,
+                                                            keepalive_expiry=HTTP_KEEPALIVE_SECONDS))
+        return _http_client
+
+
+def get_chat_model(api_key=None, **params):
+    """
+    Return the shared ChatOpenAI instance for this OpenAI key and these parameters (e.g. model_name, temperature,
+    top_p). Without a key, the OPENAI_API_KEY environment variable is used.
+    """
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    key = (api_key, _params_key(params))
+    with _lock:
+        model = _chat_models.get(key)
+    if model is None:
+        model = ChatOpenAI(openai_api_key=api_key, http_client=get_http_client(), **params)
+        with _lock:
+            model = _chat_models.setdefault(key, model)
+    return model
+
+
+def get_embeddings(api_key=None, **params):
+    """Return the shared (cached) OpenAIEmbeddings instance for this OpenAI key and these parameters."""
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    key = (api_key, _params_key(params))
+    with _lock:
+        embeddings = _embeddings.get(key)
+    if embeddings is None:
+        embeddings = CachedEmbeddings(OpenAIEmbeddings(openai_api_key=api_key, http_client=get_http_client(),
+                                                       **params))
+        with _lock:
+            embeddings = _embeddings.setdefault(key, embeddings)
+    return embeddings
+
+
+def get_pinecone_client(api_key):
+    with _lock:
+        if api_key not in _pinecone_clients:
+            _pinecone_clients[api_key] = PineconeGRPC(api_key=api_key)
+        return _pinecone_clients[api_key]
+
+
+def get_pinecone_index(api_key, index_name):
+    """Return a shared gRPC index connection, reusing its channel with keep-alive pings."""
+    key = (api_key, index_name)
+    with _lock:
+        index = _pinecone_indexes.get(key)
+    if index is None:
+        grpc_config = GRPCClientConfig(reuse_channel=True, grpc_channel_options={
+            'grpc.keepalive_time_ms': HTTP_KEEPALIVE_SECONDS * 1000,
+            'grpc.keepalive_permit_without_calls': 1,
+        })
+        index = get_pinecone_client(api_key).Index(index_name, grpc_config=grpc_config)
+        with _lock:
+            index = _pinecone_indexes.setdefault(key, index)
+    return index
+
+
+def forget_pinecone_index(api_key, index_name):
+    """Drop a cached index connection, e.g. after the index has been deleted."""
+    with _lock:
+        _pinecone_indexes.pop((api_key, index_name), None)
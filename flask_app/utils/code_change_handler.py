@@ -1,87 +1,208 @@
 import re
 import os
+import difflib
+import tempfile
+from collections import namedtuple
 
+# One ORIGINAL/UPDATED block of the generated code
+Hunk = namedtuple('Hunk', ['step', 'file_path', 'original', 'updated'])
 
-def implement_code_changes(generated_code, socketio):
-    try:
-        # Split instructions and generated_code into steps
-        generated_code_steps = generated_code.split('Step ')
-    except Exception as e:
-        error_message = f"Generated code has invalid format: {str(e)}. No changes are implemented."
-        print(error_message)
-        socketio.emit('script_output', {'data': error_message})
-        return
-
-    # Apply changes per step
-    for step, code_chunk in enumerate(generated_code_steps[1:], start=1):
-        # Extract file path
-        file_path = code_chunk.split('\n')[1].strip()
-
-        if not os.path.exists(file_path):
-            base_name = os.path.basename(file_path)
-            message = f"File: {base_name} mentioned in step {step} does not exist. Creating new file."
-            print(message)
-            socketio.emit('script_output', {'data': message})
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            open(file_path, 'w').close()
-
-        # Read the entire file content
-        with open(file_path, 'r') as f:
-            file_content = f.read()
-
-        # Create a list of lines, splitting by newline
-        file_lines = file_content.splitlines(keepends=True)
-
-        # Extract original and updated code from generated_code
-        try:
-            code_parts = re.split(r'<<<<<<< ORIGINAL|=======|>>>>>>> UPDATED', code_chunk)
-            assert len(code_parts) >= 3, "Invalid code part split"
-            original, updated = code_parts[1:3]
-        except Exception as e:
-            message = f"Invalid format in generated code for step {step}: {str(e)}. Skipping this step."
-            print(message)
-            socketio.emit('script_output', {'data': message})
+# Outcome of implement_code_changes: the files written (and which of those are new), and per hunk whether (and
+# how) it was applied or why it was rejected
+PatchResult = namedtuple('PatchResult', ['changed_paths', 'created_paths', 'applied', 'rejected'])
+
+# Minimum similarity of a fuzzy match, and the maximum number of candidate positions scored per hunk
+FUZZY_THRESHOLD = 0.85
+MAX_FUZZY_CANDIDATES = 200
+
+
+def parse_hunks(generated_code):
+    """Split the generated code into hunks; returns (hunks, rejected) where rejected holds unparsable steps."""
+    hunks, rejected = [], []
+    for step, code_chunk in enumerate(generated_code.split('Step ')[1:], start=1):
+        lines = code_chunk.split('\n')
+        file_path = lines[1].strip() if len(lines) > 1 else ''
+
+        code_parts = re.split(r'<<<<<<< ORIGINAL|=======|>>>>>>> UPDATED', code_chunk)
+        if not file_path or len(code_parts) < 3:
+            rejected.append({'step': step, 'path': file_path, 'reason': "invalid format"})
             continue
+        original, updated = code_parts[1:3]
+        hunks.append(Hunk(step, file_path, _block_lines(original), _block_lines(updated)))
+    return hunks, rejected
+
+
+def _block_lines(block):
+    # Drop the line break after the marker and the one before the next marker
+    lines = block.split('\n')
+    if lines and lines[0].strip() == '':
+        lines = lines[1:]
+    if lines and lines[-1].strip() == '':
+        lines = lines[:-1]
+    return lines
+
+
+def _normalize(line):
+    return ' '.join(line.split())
+
+
+def _indent(line):
+    return line[:len(line) - len(line.lstrip())]
+
+
+def find_block(buffer, block):
+    """
+    Locate `block` (a list of lines) in `buffer`. Tries an exact match, then one that ignores whitespace
+    differences, then a fuzzy match around anchor lines (lines equal to the first or last line of the block after
+    whitespace normalization), scoring at most MAX_FUZZY_CANDIDATES positions.
+
+    Returns (start, end, how) with `end` exclusive, or None when the block is not found.
+    """
+    size = len(block)
+    if size == 0 or size > len(buffer):
+        return None
+
+    stripped_block = [line.rstrip() for line in block]
+    stripped_buffer = [line.rstrip() for line in buffer]
+    for start in range(len(buffer) - size + 1):
+        if stripped_buffer[start:start + size] == stripped_block:
+            return start, start + size, 'exact'
+
+    normalized_block = [_normalize(line) for line in block]
+    normalized_buffer = [_normalize(line) for line in buffer]
+    for start in range(len(buffer) - size + 1):
+        if normalized_buffer[start:start + size] == normalized_block:
+            return start, start + size, 'whitespace'
 
-        # Clean-up original and updated
-        original_lines = original.splitlines(keepends=True)
-        updated_lines = updated.splitlines(keepends=True)
-        if original_lines and original_lines[0].strip() == '':
-            original_lines = original_lines[1:]
-        if updated_lines and updated_lines[0].strip() == '':
-            updated_lines = updated_lines[1:]
-
-        # If new file was created add code to this new file
-        if not file_content:
-            with open(file_path, 'w') as file:
-                file.writelines(updated_lines)
+    # Fuzzy: only score windows that start (or end) at an anchor line
+    anchors = [i for i, line in enumerate(normalized_buffer) if line and line == normalized_block[0]]
+    anchors += [i - size + 1 for i, line in enumerate(normalized_buffer) if line and line == normalized_block[-1]]
+    candidates = sorted({start for start in anchors if 0 <= start <= len(buffer) - size})[:MAX_FUZZY_CANDIDATES]
+
+    block_text = '\n'.join(normalized_block)
+    best = None
+    for start in candidates:
+        matcher = difflib.SequenceMatcher(None, '\n'.join(normalized_buffer[start:start + size]), block_text,
+                                          autojunk=False)
+        if matcher.real_quick_ratio() < FUZZY_THRESHOLD or matcher.quick_ratio() < FUZZY_THRESHOLD:
+            continue
+        ratio = matcher.ratio()
+        if ratio >= FUZZY_THRESHOLD and (best is None or ratio > best[0]):
+            best = (ratio, start)
+    if best is not None:
+        return best[1], best[1] + size, 'fuzzy'
+    return None
+
+
+def _reindent(updated, original_first, matched_first):
+    """Shift the updated lines by the indentation difference between the ORIGINAL block and the matched code."""
+    original_indent, matched_indent = _indent(original_first), _indent(matched_first)
+    if original_indent == matched_indent:
+        return updated
+    if matched_indent.startswith(original_indent):
+        extra = matched_indent[len(original_indent):]
+        return [extra + line if line.strip() else line for line in updated]
+    if original_indent.startswith(matched_indent):
+        surplus = len(original_indent) - len(matched_indent)
+        return [line[surplus:] if line[:surplus].strip() == '' else line.lstrip() for line in updated]
+    return updated
+
+
+def apply_hunks(content, hunks):
+    """
+    Apply all hunks of one file to its content, in memory. Returns (new content, applied, rejected).
+    A hunk whose ORIGINAL block is not found is rejected; it is never appended to the file instead.
+    """
+    had_newline = content.endswith('\n')
+    buffer = content.split('\n') if content else []
+    if had_newline:
+        buffer = buffer[:-1]
+
+    applied, rejected = [], []
+    for hunk in hunks:
+        if not [line for line in hunk.original if line.strip()]:
+            # Empty ORIGINAL: an end-of-file insertion (or the content of a new file)
+            buffer = buffer + hunk.updated
+            applied.append({'step': hunk.step, 'path': hunk.file_path, 'match': 'append'})
             continue
 
-        # Check if this is an end-of-file insertion
-        if not original.strip():
-            # Append the updated content to the end of the file
-            after_lines = file_lines + updated_lines
+        match = find_block(buffer, hunk.original)
+        if match is None:
+            rejected.append({'step': hunk.step, 'path': hunk.file_path, 'reason': "original code not found"})
+            continue
+
+        start, end, how = match
+        updated = hunk.updated if how == 'exact' else _reindent(hunk.updated, hunk.original[0], buffer[start])
+        buffer = buffer[:start] + updated + buffer[end:]
+        applied.append({'step': hunk.step, 'path': hunk.file_path, 'match': how})
+
+    new_content = '\n'.join(buffer)
+    if buffer and (had_newline or not content):
+        new_content += '\n'
+    return new_content, applied, rejected
+
+
+def _write_atomic(file_path, content):
+    directory = os.path.dirname(file_path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(file_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+        if os.path.exists(file_path):
+            os.chmod(tmp_path, os.stat(file_path).st_mode)
+        os.replace(tmp_path, file_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def implement_code_changes(generated_code, socketio):
+    """
+    Apply the ORIGINAL/UPDATED blocks of the generated code. Hunks are grouped per file and applied in memory in
+    step order, after which every changed file is written once, atomically. Returns a PatchResult.
+    """
+    hunks, rejected = parse_hunks(generated_code or '')
+    applied, changed_paths, created_paths = [], [], []
+
+    # Group hunks by file, keeping the order in which files are first mentioned
+    hunks_per_file = {}
+    for hunk in hunks:
+        hunks_per_file.setdefault(hunk.file_path, []).append(hunk)
+
+    for file_path, file_hunks in hunks_per_file.items():
+        is_new = not os.path.exists(file_path)
+        if is_new:
+            message = f"File: {os.path.basename(file_path)} mentioned in step {file_hunks[0].step} does not exist. " \
+                      f"Creating new file."
+            print(message)
+            socketio.emit('script_output', {'data': message})
+            content = ''
         else:
-            try:
-                # Find the index where the original content starts
-                start_index = file_content.index(original.lstrip())
+            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                content = f.read()
 
-                # Determine line indices from character indices
-                start_line_index = file_content.count('\n', 0, start_index)
-                end_line_index = start_line_index + len(original_lines) - 1
+        new_content, file_applied, file_rejected = apply_hunks(content, file_hunks)
+        applied.extend(file_applied)
+        rejected.extend(file_rejected)
 
-                # Create new version of the file
-                after_lines = file_lines[:start_line_index] + updated_lines + file_lines[end_line_index + 1:]
+        if file_applied and (is_new or new_content != content):
+            _write_atomic(file_path, new_content)
+            changed_paths.append(file_path)
+            if is_new:
+                created_paths.append(file_path)
 
-            except ValueError:
-                # If 'original' is not found, append 'updated' to the end of the file
-                after_lines = file_lines + updated_lines
-                message = f"Original part of step {step} not found. Applying changes to end of file."
-                print(message)
-                socketio.emit('script_output', {'data': message})
+    for hunk in rejected:
+        message = f"Could not apply step {hunk['step']} ({os.path.basename(hunk['path']) or 'unknown file'}): " \
+                  f"{hunk['reason']}. Skipping this step."
+        print(message)
+        socketio.emit('script_output', {'data': message})
 
-        # Apply changes
-        with open(file_path, 'w') as file:
-            file.writelines(after_lines)
+    fuzzy = sum(1 for hunk in applied if hunk['match'] in ('whitespace', 'fuzzy'))
+    message = f"Applied {len(applied)} of {len(applied) + len(rejected)} code change(s) to {len(changed_paths)} " \
+              f"file(s)" + (f" ({fuzzy} matched approximately)." if fuzzy else ".")
+    print(message)
+    socketio.emit('script_output', {'data': message})
 
-    return
+    return PatchResult(changed_paths, created_paths, applied, sorted(rejected, key=lambda hunk: hunk['step']))
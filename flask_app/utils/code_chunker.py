@@ -0,0 +1,215 @@
+import os
+import ast
+import hashlib
+from urllib.parse import quote
+
+from langchain_core.documents import Document
+from langchain_text_splitters import Language, RecursiveCharacterTextSplitter
+
+# Bumped whenever the chunking changes, so indexed files are re-chunked once
+CHUNKER_VERSION = 3
+
+# File extension -> (language name, LangChain splitter language or None, content type)
+EXTENSIONS = {
+    '.py': ('python', Language.PYTHON, 'code'),
+    '.js': ('javascript', Language.JS, 'code'),
+    '.jsx': ('javascript', Language.JS, 'code'),
+    '.mjs': ('javascript', Language.JS, 'code'),
+    '.ts': ('typescript', Language.TS, 'code'),
+    '.tsx': ('typescript', Language.TS, 'code'),
+    '.java': ('java', Language.JAVA, 'code'),
+    '.kt': ('kotlin', Language.KOTLIN, 'code'),
+    '.go': ('go', Language.GO, 'code'),
+    '.rb': ('ruby', Language.RUBY, 'code'),
+    '.rs': ('rust', Language.RUST, 'code'),
+    '.php': ('php', Language.PHP, 'code'),
+    '.c': ('c', Language.C, 'code'),
+    '.h': ('c', Language.C, 'code'),
+    '.cpp': ('cpp', Language.CPP, 'code'),
+    '.hpp': ('cpp', Language.CPP, 'code'),
+    '.cs': ('csharp', Language.CSHARP, 'code'),
+    '.scala': ('scala', Language.SCALA, 'code'),
+    '.swift': ('swift', Language.SWIFT, 'code'),
+    '.lua': ('lua', Language.LUA, 'code'),
+    '.sol': ('solidity', Language.SOL, 'code'),
+    '.proto': ('proto', Language.PROTO, 'code'),
+    '.html': ('html', Language.HTML, 'markup'),
+    '.htm': ('html', Language.HTML, 'markup'),
+    '.md': ('markdown', Language.MARKDOWN, 'documentation'),
+    '.rst': ('rst', Language.RST, 'documentation'),
+    '.tex': ('latex', Language.LATEX, 'documentation'),
+    '.css': ('css', None, 'stylesheet'),
+    '.scss': ('scss', None, 'stylesheet'),
+    '.sql': ('sql', None, 'query'),
+    '.json': ('json', None, 'config'),
+    '.yaml': ('yaml', None, 'config'),
+    '.yml': ('yaml', None, 'config'),
+    '.toml': ('toml', None, 'config'),
+    '.ini': ('ini', None, 'config'),
+}
+
+# Separators for languages LangChain has no splitter for
+SEPARATORS = {
+    'css': ["\n}\n", "\n\n", "\n", " ", ""],
+    'scss': ["\n}\n", "\n\n", "\n", " ", ""],
+    'sql': [";\n", "\n\n", "\n", " ", ""],
+}
+
+
+def chunk_id(relative_path, content, occurrence=0):
+    """
+    Stable chunk ID: the (ASCII-quoted) file path and a hash of the chunk content. Unchanged chunks keep their ID
+    when other parts of the file change; identical chunks within one file are told apart by their occurrence.
+    """
+    content_hash = hashlib.sha256(content.encode('utf-8', errors='ignore')).hexdigest()
+    id_ = f"{quote(relative_path, safe='/._-')}#{content_hash[:16]}"
+    return f"{id_}#{occurrence}" if occurrence else id_
+
+
+def _text_splitter(language, splitter_language, chunk_size, chunk_overlap):
+    if splitter_language is not None:
+        return RecursiveCharacterTextSplitter.from_language(language=splitter_language, chunk_size=chunk_size,
+                                                            chunk_overlap=chunk_overlap, add_start_index=True)
+    return RecursiveCharacterTextSplitter(separators=SEPARATORS.get(language), chunk_size=chunk_size,
+                                          chunk_overlap=chunk_overlap, add_start_index=True)
+
+
+def _split_text(text, language, splitter_language, chunk_size, chunk_overlap, first_line=1):
+    """Split text with the language's separators; returns (content, start line, end line) tuples."""
+    splitter = _text_splitter(language, splitter_language, chunk_size, chunk_overlap)
+    chunks = []
+    for doc in splitter.create_documents([text]):
+        start_line = first_line + text.count('\n', 0, doc.metadata['start_index'])
+        chunks.append((doc.page_content, start_line, start_line + doc.page_content.count('\n')))
+    return chunks
+
+
+def _python_segments(text):
+    """
+    Split Python source along its top-level statements: every function and class becomes its own segment (with
+    its decorators and the comments right above it), other statements in between are grouped together.
+    Returns (symbol, kind, start line, end line) tuples that cover the whole file, or None on a syntax error.
+    """
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        return None
+
+    line_count = len(text.splitlines())
+    segments = []
+    start = 1
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            kind = 'class' if isinstance(node, ast.ClassDef) else 'function'
+            segments.append((node.name, kind, start, node.end_lineno))
+        else:
+            if segments and segments[-1][1] == 'module':
+                segments[-1] = (None, 'module', segments[-1][2], node.end_lineno)
+            else:
+                segments.append((None, 'module', start, node.end_lineno))
+        start = node.end_lineno + 1
+
+    if start <= line_count:
+        if segments:
+            symbol, kind, segment_start, _ = segments[-1]
+            segments[-1] = (symbol, kind, segment_start, line_count)
+        else:
+            segments.append((None, 'module', 1, line_count))
+    return segments
+
+
+def _python_class_segments(lines, node_name, start, end):
+    """Split a (too large) class into a segment per method, keeping the class header with the first one."""
+    class_source = "\n".join(lines[start - 1:end])
+    try:
+        class_node = ast.parse(class_source).body[0]
+    except (SyntaxError, ValueError, IndexError):
+        return None
+
+    segments = []
+    segment_start = start
+    for node in class_node.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            node_end = start + node.end_lineno - 1
+            segments.append((f"{node_name}.{node.name}", 'function', segment_start, node_end))
+            segment_start = node_end + 1
+    if not segments:
+        return None
+    if segment_start <= end:
+        symbol, kind, first, _ = segments[-1]
+        segments[-1] = (symbol, kind, first, end)
+    return segments
+
+
+def _chunk_python(text, chunk_size, chunk_overlap):
+    """Returns (content, symbol, kind, start line, end line) tuples aligned to function/class boundaries."""
+    segments = _python_segments(text)
+    if segments is None:
+        return None
+
+    lines = text.split('\n')
+    chunks = []
+    for symbol, kind, start, end in segments:
+        # Leave out the blank lines around a segment, so its line range starts at its first line of code
+        while start <= end and not lines[start - 1].strip():
+            start += 1
+        while end >= start and not lines[end - 1].strip():
+            end -= 1
+        if start > end:
+            continue
+        content = "\n".join(lines[start - 1:end])
+        if len(content) > chunk_size and kind == 'class':
+            method_segments = _python_class_segments(lines, symbol, start, end)
+            if method_segments:
+                for method_symbol, method_kind, method_start, method_end in method_segments:
+                    method_content = "\n".join(lines[method_start - 1:method_end])
+                    chunks.extend(_fit(method_content, method_symbol, method_kind, method_start, method_end,
+                                       chunk_size, chunk_overlap))
+                continue
+        chunks.extend(_fit(content, symbol, kind, start, end, chunk_size, chunk_overlap))
+    return chunks
+
+
+def _fit(content, symbol, kind, start, end, chunk_size, chunk_overlap):
+    # Segments that are still too large are split along Python separators
+    if len(content) <= chunk_size:
+        return [(content, symbol, kind, start, end)]
+    return [(part, symbol, kind, part_start, part_end)
+            for part, part_start, part_end in _split_text(content, 'python', Language.PYTHON, chunk_size,
+                                                          chunk_overlap, first_line=start)]
+
+
+def chunk_document(doc, relative_path, chunk_size=2000, chunk_overlap=100):
+    """
+    Split a loaded file (Document) into chunks with a splitter that matches its extension. Python files are split
+    along function and class boundaries. Every chunk carries its path, language, symbol (for Python), line range,
+    content type (of the file: 'code', 'markup', ...), kind of construct (for Python: 'function', 'class' or
+    'module') and a stable, content-hashed chunk ID in its metadata.
+    """
+    extension = os.path.splitext(relative_path)[1].lower()
+    language, splitter_language, content_type = EXTENSIONS.get(extension, ('text', None, 'text'))
+    text = doc.page_content
+
+    chunks = None
+    if language == 'python':
+        chunks = _chunk_python(text, chunk_size, chunk_overlap)
+    if chunks is None:
+        chunks = [(content, None, None, start, end)
+                  for content, start, end in _split_text(text, language, splitter_language, chunk_size,
+                                                         chunk_overlap)]
+
+    documents = []
+    occurrences = {}
+    for content, symbol, kind, start_line, end_line in chunks:
+        id_ = chunk_id(relative_path, content, occurrences.get(content, 0))
+        occurrences[content] = occurrences.get(content, 0) + 1
+
+        metadata = {**doc.metadata, 'path': relative_path, 'language': language, 'content_type': content_type,
+                    'start_line': start_line, 'end_line': end_line, 'chunk_id': id_}
+        # Vector databases don't accept null metadata values, so the keys are left out without a symbol or kind
+        if kind:
+            metadata['kind'] = kind
+        if symbol:
+            metadata['symbol'] = symbol
+        documents.append(Document(page_content=content, metadata=metadata))
+    return documents
@@ -0,0 +1,85 @@
+import math
+import functools
+
+import numpy as np
+import tiktoken
+
+from utils.client_registry import get_embeddings
+
+# Used to estimate token counts when no encoding can be loaded; on the low side, so estimates err on the high side
+CHARS_PER_TOKEN = 3
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model_name):
+    """The tokenizer of `model_name`, or None when it can't be loaded (e.g. offline, on first use)."""
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            # Unknown (e.g. newer) model names: fall back to the encoding of the current OpenAI models
+            return tiktoken.get_encoding('o200k_base')
+    except Exception as e:
+        # tiktoken downloads the encoding the first time it is used
+        print(f"Warning: Could not load the tokenizer for {model_name}, estimating token counts instead: {e}")
+        return None
+
+
+def count_tokens(text, model_name):
+    """Number of tokens `text` takes up in a prompt for `model_name` (estimated if the tokenizer can't be loaded)."""
+    encoding = _encoding(model_name)
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_budget(text, token_budget, model_name):
+    """Keep whole lines of `text` as long as they fit in `token_budget` tokens."""
+    if count_tokens(text, model_name) <= token_budget:
+        return text
+
+    marker = "... (truncated)"
+    remaining = token_budget - count_tokens(marker, model_name)
+    lines = []
+    for line in text.split("\n"):
+        tokens = count_tokens(line + "\n", model_name)
+        if tokens > remaining:
+            break
+        lines.append(line)
+        remaining -= tokens
+    lines.append(marker)
+    return "\n".join(lines)
+
+
+def select_within_budget(query, documents, token_budget, model_name, top_k=None, embeddings=None):
+    """
+    Select the `documents` ((key, text) pairs) most similar to `query` that together fit in `token_budget` tokens.
+
+    When all documents fit, they are all returned in their original order without embedding anything. Otherwise
+    the (at most `top_k`) documents with the highest cosine similarity to the query are packed greedily: a document
+    that doesn't fit in the remaining budget is skipped in favour of smaller, less similar ones. Embeddings go
+    through the embedding cache, so unchanged documents are only embedded once.
+    """
+    token_counts = [count_tokens(text, model_name) for _, text in documents]
+    if sum(token_counts) <= token_budget:
+        return list(documents)
+
+    embeddings = embeddings or get_embeddings()
+    document_vectors = np.asarray(embeddings.embed_documents([text for _, text in documents]), dtype=np.float32)
+    query_vector = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+
+    norms = np.linalg.norm(document_vectors, axis=1) * np.linalg.norm(query_vector)
+    norms[norms == 0] = 1
+    scores = document_vectors @ query_vector / norms
+
+    ranking = np.argsort(-scores)
+    if top_k is not None:
+        ranking = ranking[:top_k]
+
+    selected = []
+    remaining = token_budget
+    for i in ranking:
+        if token_counts[i] <= remaining:
+            selected.append(documents[i])
+            remaining -= token_counts[i]
+    return selected
@@ -1,22 +1,68 @@
 import os
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, undefer_group
+from sqlalchemy import create_engine, event, insert, inspect, text
 from contextlib import contextmanager
 
+from config import USER_STORY_PAGE_SIZE
+
 from codebase.codebase_class import Codebase, Base
 from userstory.userstory_class import UserStory
+from jobs.job_class import Job  # noqa: F401 (registers the jobs table)
 
 
 class DatabaseManager:
     def __init__(self, db_name, db_base_path):
         db_path = os.path.join(db_base_path, db_name)
         db_url = f'sqlite:///{db_path}'
-        self.engine = create_engine(db_url)
+        # Background jobs and request handlers share the database, so wait for locks instead of failing right away
+        self.engine = create_engine(db_url, connect_args={'timeout': 30, 'check_same_thread': False})
+        event.listen(self.engine, 'connect', self._set_sqlite_pragmas)
         self.Session = sessionmaker(bind=self.engine)
 
+    @staticmethod
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets readers continue while a job writes; NORMAL sync is safe in WAL mode and avoids an fsync per commit
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=30000")
+        cursor.execute("PRAGMA cache_size=-16000")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
     def init_db(self):
         """Initialize the database schema."""
         Base.metadata.create_all(self.engine)
+        self._add_missing_columns()
+        self._add_missing_indexes()
+
+    def _add_missing_columns(self):
+        """Add columns that were introduced after a table was created (create_all only creates missing tables)."""
+        inspector = inspect(self.engine)
+        with self.engine.begin() as connection:
+            for table in Base.metadata.sorted_tables:
+                existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in existing_columns:
+                        column_type = column.type.compile(dialect=self.engine.dialect)
+                        connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+    def _add_missing_indexes(self):
+        """Create indexes that were introduced after a table was created."""
+        with self.engine.begin() as connection:
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(connection, checkfirst=True)
+
+    @contextmanager
+    def read_session(self):
+        """Provide a session for reads only: nothing is flushed or committed, so it never takes a write lock."""
+        session = self.Session(autoflush=False)
+        try:
+            yield session
+        finally:
+            session.rollback()
+            session.close()
 
     @contextmanager
     def session_scope(self):
@@ -37,6 +83,8 @@ class DatabaseManager:
             # Update existing codebase
             existing_codebase.folder_structure = codebase.folder_structure
             existing_codebase.summary = codebase.summary
+            existing_codebase.summary_manifest = codebase.summary_manifest
+            existing_codebase.directory_summaries = codebase.directory_summaries
             existing_codebase.description = codebase.description
             session.merge(existing_codebase)
         else:
@@ -53,16 +101,56 @@ class DatabaseManager:
         user_story.codebase = codebase
         session.add(user_story)
         session.commit()
+        return user_story.id
+
+    def add_user_stories(self, session, codebase_id, stories):
+        """Insert new user stories ((jira_id, text) pairs) for a codebase in one statement; returns their ids."""
+        ids = []
+        if stories:
+            ids = list(session.scalars(insert(UserStory).returning(UserStory.id, sort_by_parameter_order=True), [
+                dict(jira_id=str(jira_id), original_story=text, status="to_pick_up", codebase_id=codebase_id)
+                for jira_id, text in stories]))
+        session.commit()
+        return ids
 
-    def get_codebase(self, session, codebase_name: str):
-        return session.query(Codebase).filter(Codebase.name == codebase_name).one_or_none()
+    def get_codebase(self, session, codebase_name: str, with_content=False):
+        """Get a codebase by name; with `with_content` its deferred texts (summary etc.) are loaded right away."""
+        query = session.query(Codebase).filter(Codebase.name == codebase_name)
+        if with_content:
+            query = query.options(undefer_group('content'))
+        return query.one_or_none()
 
-    def get_user_story(self, session, codebase_name: str, current_user_story: str):
-        codebase = session.query(Codebase).filter(Codebase.name == codebase_name).one()
-        return session.query(UserStory).filter(
-            UserStory.codebase_id == codebase.id,
+    def get_user_story(self, session, codebase_name: str, current_user_story: str, with_content=False):
+        query = session.query(UserStory).join(UserStory.codebase).filter(
+            Codebase.name == codebase_name,
             UserStory.original_story == current_user_story
-        ).one_or_none()
+        )
+        if with_content:
+            query = query.options(undefer_group('content'))
+        return query.one_or_none()
+
+    def get_user_story_page(self, session, codebase_name: str, after_id=0, limit=USER_STORY_PAGE_SIZE,
+                            exclude_statuses=('implemented_manual_changes', 'implemented_successfully')):
+        """
+        List the user stories of a codebase (oldest first) as dicts with their id, text and jira_id, one page at a
+        time: the next page holds the stories with an id above the last one of the previous page (`after_id`), so
+        stories added, deleted or finished in the meantime don't shift the pages. Returns (stories, has_more).
+        """
+        rows = session.query(UserStory.id, UserStory.original_story, UserStory.jira_id).join(UserStory.codebase).filter(
+            Codebase.name == codebase_name,
+            UserStory.status.notin_(exclude_statuses),
+            UserStory.id > after_id
+        ).order_by(UserStory.id).limit(limit + 1).all()
+        stories = [dict(id=id_, text=text, jira_id=jira_id) for id_, text, jira_id in rows[:limit]]
+        return stories, len(rows) > limit
+
+    def get_jira_ids(self, session, codebase_name: str):
+        """The Jira IDs of all user stories of a codebase."""
+        rows = session.query(UserStory.jira_id).join(UserStory.codebase).filter(
+            Codebase.name == codebase_name,
+            UserStory.jira_id.isnot(None)
+        ).all()
+        return {jira_id for jira_id, in rows if jira_id}
 
     def get_all_project_names(self, session):
-        return [codebase.name for codebase in session.query(Codebase).all()]
+        return [name for name, in session.query(Codebase.name).order_by(Codebase.id)]
@@ -0,0 +1,145 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from config import EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding store keyed by (model name, text hash), backed by SQLite.
+
+    Recently used vectors are also kept in a small in-memory LRU, so repeated queries don't touch the disk.
+    When the table grows beyond `max_entries`, the least recently used rows are evicted.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES, memory_entries=2048):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)")
+        self._connection.commit()
+        self._count = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def text_hash(text):
+        return hashlib.sha256(text.encode('utf-8', errors='ignore')).hexdigest()
+
+    def get_many(self, model, text_hashes):
+        """Return a dict with the cached vectors for the given hashes (missing hashes are left out)."""
+        found = {}
+        with self._lock:
+            missing = []
+            for text_hash in text_hashes:
+                key = (model, text_hash)
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[text_hash] = self._memory[key]
+                else:
+                    missing.append(text_hash)
+
+            now = time.time()
+            for i in range(0, len(missing), 500):
+                batch = missing[i:i + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = self._connection.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch]).fetchall()
+                for text_hash, blob in rows:
+                    vector = array('f', blob).tolist()
+                    found[text_hash] = vector
+                    self._remember((model, text_hash), vector)
+                self._connection.executemany("UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                                             [(now, model, text_hash) for text_hash, _ in rows])
+            self._connection.commit()
+        return found
+
+    def put_many(self, model, items):
+        """Store (text_hash, vector) pairs and evict the least recently used rows when over capacity."""
+        now = time.time()
+        with self._lock:
+            cursor = self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(model, text_hash, array('f', vector).tobytes(), now) for text_hash, vector in items])
+            self._count += max(cursor.rowcount, 0)
+            for text_hash, vector in items:
+                self._remember((model, text_hash), list(vector))
+
+            if self._count > self.max_entries:
+                # Replaced rows were counted as new, so recount before evicting
+                self._count = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if self._count > self.max_entries:
+                # Evict an extra 10% at once, so eviction doesn't run on every insert
+                to_evict = self._count - int(self.max_entries * 0.9)
+                self._connection.execute(
+                    "DELETE FROM embeddings WHERE rowid IN "
+                    "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)", (to_evict,))
+                self._count = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            self._connection.commit()
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """Return the process-wide embedding cache, creating it on first use."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache()
+        return _default_cache
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an `Embeddings` model, so every text is only sent to the embedding API once."""
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache = None):
+        self.embeddings = embeddings
+        self.cache = cache or get_embedding_cache()
+        self.model = getattr(embeddings, 'model', embeddings.__class__.__name__)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [self.cache.text_hash(text) for text in texts]
+        cached = self.cache.get_many(self.model, list(set(hashes)))
+
+        # Embed every distinct uncached text once
+        missing = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in cached and text_hash not in missing:
+                missing[text_hash] = text
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model, new_items)
+            cached.update(new_items)
+
+        return [cached[text_hash] for text_hash in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
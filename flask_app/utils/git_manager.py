@@ -1,10 +1,6 @@
 import os
+import time
 import git
-import threading
-from flask_socketio import SocketIO, emit
-
-socketio = SocketIO()
-git_feedback_received = threading.Event()
 
 
 class GitManager:
@@ -51,17 +47,63 @@ class GitManager:
             message = self.commit_message if self.commit_message else "Auto-commit"
         self.repo.index.commit(message)
 
-    def handle_dirty_repo(self):
-        if self.is_dirty():
-            emit('script_output', {'data': "The Git repository has uncommitted changes."})
-            emit('request_git_feedback_dirty', {'message': "Choose an action:"})
-            git_feedback_received.wait()
+    def handle_dirty_repo(self, socketio, wait_for_feedback):
+        if not self.is_dirty():
+            return
+
+        socketio.emit('script_output', {'data': "The Git repository has uncommitted changes."})
+        socketio.emit('request_git_feedback_dirty', {'message': "Choose an action:"})
+        feedback = wait_for_feedback()
+
+        if feedback == 'Commit Changes':
+            self.commit_changes()
+            socketio.emit('script_output', {'data': 'Changes have been committed.'})
+        elif feedback == 'Discard Changes':
+            self.discard_changes()
+            socketio.emit('script_output', {'data': 'Changes have been discarded.'})
+        elif feedback == 'Wait for Clean Repository':
+            socketio.emit('script_output', {'data': 'Please handle the changes manually.'})
+            while self.is_dirty():
+                socketio.emit('script_output', {'data': 'Waiting for the repository to be clean...'})
+                time.sleep(10)
+            socketio.emit('script_output', {'data': 'Repository is clean, continuing...'})
+
+    def head_commit(self):
+        try:
+            return self.repo.head.commit.hexsha
+        except ValueError:
+            # Repository without commits
+            return None
+
+    def changed_files(self, since=None):
+        """
+        Files created, modified and deleted since commit `since` (committed, staged, unstaged and untracked changes),
+        as sorted lists of '/'-separated paths relative to the repository root. Without a commit, the changes
+        compared to the index are used.
+        """
+        created, modified, deleted = set(), set(), set()
+        if since:
+            parts = self.repo.git.diff('--name-status', '-z', '--no-renames', since).split('\0')
+            changes = zip(parts[0::2], parts[1::2])
+        else:
+            entries = self.repo.git.status('--porcelain', '-z', '--untracked-files=all', '--no-renames').split('\0')
+            changes = ((entry[:2].strip(), entry[3:]) for entry in entries if entry)
+
+        for status, path in changes:
+            if not path:
+                continue
+            if 'A' in status or '?' in status:
+                created.add(path)
+            elif 'D' in status:
+                deleted.add(path)
+            else:
+                modified.add(path)
+        created.update(path for path in self.repo.git.ls_files('--others', '--exclude-standard', '-z').split('\0')
+                       if path)
+
+        return {'created': sorted(created), 'modified': sorted(modified - created), 'deleted': sorted(deleted)}
 
     def remove_msg_hook(self):
         hook_path = os.path.join(self.repo.git_dir, 'hooks', 'prepare-commit-msg')
         if os.path.exists(hook_path):
             os.remove(hook_path)
-
-
-def finalize_git_feedback():
-    git_feedback_received.set()
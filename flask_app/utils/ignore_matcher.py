@@ -0,0 +1,98 @@
+import os
+import re
+import json
+import fnmatch
+import threading
+
+import git
+
+EMPTY_IGNORE_CONFIG = {'ignored_directories': [], 'ignored_files': [], 'ignored_extensions': [], 'ignored_patterns': []}
+
+
+class IgnoreMatcher:
+    """
+    Compiled form of an ignore configuration (see ignore.json).
+
+    Directory and file names are looked up in sets, extensions in a suffix set (every suffix of a file name that
+    starts at a '.'), and the optional `ignored_patterns` globs (matched against the '/'-separated path relative to
+    the repository root) are combined into a single regular expression.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.directories = set(config.get('ignored_directories', []))
+        self.files = set(config.get('ignored_files', []))
+
+        extensions = config.get('ignored_extensions', [])
+        self.suffixes = {ext for ext in extensions if ext.startswith('.')}
+        # Extensions without a leading dot can match anywhere at the end of a name, so they need endswith
+        self.other_suffixes = tuple(ext for ext in extensions if not ext.startswith('.'))
+
+        patterns = config.get('ignored_patterns', [])
+        self.pattern = re.compile('|'.join(fnmatch.translate(p) for p in patterns)) if patterns else None
+
+    def ignores_directory(self, name, relative_path=None):
+        if name in self.directories:
+            return True
+        return self.pattern is not None and relative_path is not None and bool(self.pattern.match(relative_path))
+
+    def ignores_file(self, name, relative_path=None):
+        if name in self.files:
+            return True
+
+        dot = name.find('.')
+        while dot != -1:
+            if name[dot:] in self.suffixes:
+                return True
+            dot = name.find('.', dot + 1)
+
+        if self.other_suffixes and name.endswith(self.other_suffixes):
+            return True
+        return self.pattern is not None and relative_path is not None and bool(self.pattern.match(relative_path))
+
+
+def read_ignore_config(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        print(f"Warning: Ignore file not found at {path}. Using empty configuration.")
+    except json.JSONDecodeError:
+        print(f"Warning: Invalid JSON in ignore file at {path}. Using empty configuration.")
+    return dict(EMPTY_IGNORE_CONFIG)
+
+
+# Compiled matchers per ignore file, together with the mtime of the file they were compiled from
+_matchers = {}
+_matchers_lock = threading.Lock()
+
+
+def load_ignore_matcher(path):
+    """Return the compiled matcher for an ignore file; it is only re-parsed when the file's mtime changes."""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        mtime = None
+
+    with _matchers_lock:
+        cached = _matchers.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+    matcher = IgnoreMatcher(read_ignore_config(path))
+    with _matchers_lock:
+        _matchers[path] = (mtime, matcher)
+    return matcher
+
+
+def git_visible_files(directory):
+    """
+    Return the set of files git would consider part of the repository in `directory` (tracked files plus untracked
+    files that are not excluded by .gitignore), as '/'-separated paths relative to `directory`. Returns None when
+    `directory` is not inside a git repository.
+    """
+    try:
+        output = git.Git(directory).ls_files('--cached', '--others', '--exclude-standard', '-z')
+    except (git.exc.GitCommandError, git.exc.GitCommandNotFound, OSError):
+        return None
+    return {path for path in output.split('\0') if path}
@@ -1,29 +1,77 @@
+import threading
+
 from jira.client import JIRA
+from jira.exceptions import JIRAError
+
+from config import JIRA_IMPORT_PAGE_SIZE, JIRA_TIMEOUT_SECONDS
+from utils.retry import call_with_retries
+
+# Transition IDs per project workflow, shared by all JiraIntegration instances: (server, project) -> {status: id}
+_transition_ids = {}
+_transition_ids_lock = threading.Lock()
 
 
 class JiraIntegration:
-    def __init__(self, base_url, username, token, project):
+    """
+    Calls to the Jira REST API for one project. The client is only created (and the server contacted) on first use;
+    a ready-made `client` (e.g. one pointed at a fake Jira server) can be passed in instead.
+    """
+
+    def __init__(self, base_url, username, token, project, client=None):
+        self.base_url = base_url
+        self.username = username
+        self.token = token
         self.project = project
-        self.client = JIRA(options={'server': base_url}, basic_auth=(username, token))
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            # Requests are retried by our callers (see utils/retry.py), so the client itself doesn't retry
+            self._client = JIRA(options={'server': self.base_url}, basic_auth=(self.username, self.token),
+                                timeout=JIRA_TIMEOUT_SECONDS, max_retries=0)
+        return self._client
+
+    def iter_issue_pages(self, jql, fields='summary', page_size=JIRA_IMPORT_PAGE_SIZE):
+        """Yield all issues matching `jql` one page at a time, fetching only `fields`."""
+        start_at = 0
+        while True:
+            page = call_with_retries(lambda: self.client.search_issues(jql, startAt=start_at, maxResults=page_size,
+                                                                       fields=fields))
+            if not page:
+                return
+            yield page
+            start_at += len(page)
+            # Servers may return fewer issues than asked for, so a short page doesn't mean it was the last one
+            total = getattr(page, 'total', None)
+            if getattr(page, 'isLast', None) or (total is not None and start_at >= total):
+                return
 
     def move_issue(self, issue_id, status):
-        # Get the available transitions for the issue
-        transitions = self.client.transitions(issue_id)
+        # Use the transition ID found earlier for this workflow, if any
+        key = (self.base_url, self.project)
+        with _transition_ids_lock:
+            transition_id = _transition_ids.get(key, {}).get(status)
+        if transition_id is not None:
+            try:
+                self.client.transition_issue(issue_id, transition_id)
+                return
+            except JIRAError as e:
+                if e.status_code != 400:
+                    raise
+                # The transition is not available from the issue's current status: look it up again below
 
-        # Find the transition ID for status
-        in_progress_transition_id = None
-        for transition in transitions:
-            if transition['name'] == status:
-                in_progress_transition_id = transition['id']
-                break
+        # Get the available transitions for the issue and remember their IDs
+        transitions = {transition['name']: transition['id'] for transition in self.client.transitions(issue_id)}
+        with _transition_ids_lock:
+            _transition_ids.setdefault(key, {}).update(transitions)
 
         # If we found the transition ID, use it to transition the issue
-        if in_progress_transition_id:
-            self.client.transition_issue(issue_id, in_progress_transition_id)
+        if status in transitions:
+            self.client.transition_issue(issue_id, transitions[status])
         else:
             print(f"Could not find {status} transition for the JIRA issue.")
 
     def post_comment(self, issue_id, comment_text):
         # Add the comment to the issue
         self.client.add_comment(issue_id, comment_text)
-
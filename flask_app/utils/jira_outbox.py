@@ -0,0 +1,111 @@
+import time
+import threading
+from collections import OrderedDict, deque, namedtuple
+
+from config import JIRA_OUTBOX_RETRIES, JIRA_COMMENT_MAX_CHARS
+from utils.retry import is_transient_error, backoff_delay
+
+# One queued call: `getattr(jira, action)(issue_id, *args)`; `on_error(message)` is called when it finally fails.
+# `attempt` counts the failed tries so far and `not_before` (a time.time() value) delays the next one.
+Update = namedtuple('Update', ['jira', 'action', 'issue_id', 'args', 'kwargs', 'on_error', 'attempt', 'not_before'])
+
+
+class JiraOutbox:
+    """
+    Sends updates (comments, transitions) to Jira on a background thread, so a slow or failing Jira never holds up
+    a user story.
+
+    Updates of one issue are sent in the order they were queued; issues take turns. An update that fails with a
+    transient error goes back to the front of its issue's queue with a backoff delay, during which the updates of
+    other issues are sent. Comments queued right after each other for the same issue are combined into one
+    comment (up to `max_comment_chars`), so a Jira that falls behind catches up with fewer requests.
+    """
+
+    def __init__(self, retries=JIRA_OUTBOX_RETRIES, base_delay=2, max_comment_chars=JIRA_COMMENT_MAX_CHARS):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_comment_chars = max_comment_chars
+        self._condition = threading.Condition()
+        self._pending = OrderedDict()  # (server, issue id) -> deque of Updates
+        self._in_flight = 0
+        self._thread = None
+
+    def submit(self, jira, action, issue_id, *args, on_error=None, **kwargs):
+        """Queue `jira.<action>(issue_id, *args, **kwargs)` and return straight away."""
+        update = Update(jira, action, issue_id, args, kwargs, on_error, 0, 0)
+        with self._condition:
+            queue = self._pending.setdefault((jira.base_url, issue_id), deque())
+            if queue and self._can_combine(queue[-1], update):
+                queue[-1] = queue[-1]._replace(args=(f"{queue[-1].args[0]}\n\n{update.args[0]}",))
+            else:
+                queue.append(update)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name='jira-outbox', daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def _can_combine(self, queued, update):
+        return (queued.action == update.action == 'post_comment' and queued.jira is update.jira
+                and not queued.kwargs and not update.kwargs
+                and len(queued.args[0]) + len(update.args[0]) + 2 <= self.max_comment_chars)
+
+    def flush(self, timeout=None):
+        """Wait until every queued update has been sent (or has failed); returns False on a timeout."""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._in_flight, timeout)
+
+    def _next_update(self):
+        """Take the first update that is due, in turn order; returns (None, seconds until one is due) otherwise."""
+        now = time.time()
+        first_due = None
+        for key, queue in self._pending.items():
+            if queue[0].not_before <= now:
+                update = queue.popleft()
+                if queue:
+                    # Let the other issues go first
+                    self._pending.move_to_end(key)
+                else:
+                    del self._pending[key]
+                return update, None
+            first_due = queue[0].not_before if first_due is None else min(first_due, queue[0].not_before)
+        return None, (first_due - now if first_due is not None else None)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                update, wait = self._next_update()
+                while update is None:
+                    self._condition.wait(wait)
+                    update, wait = self._next_update()
+                self._in_flight += 1
+
+            try:
+                self._send(update)
+            finally:
+                with self._condition:
+                    self._in_flight -= 1
+                    self._condition.notify_all()
+
+    def _send(self, update):
+        try:
+            getattr(update.jira, update.action)(update.issue_id, *update.args, **update.kwargs)
+        except Exception as e:
+            attempt = update.attempt + 1
+            if attempt <= self.retries and is_transient_error(e):
+                # Retry later from the front of the issue's queue, so its updates stay in order
+                delay = backoff_delay(attempt, self.base_delay)
+                with self._condition:
+                    key = (update.jira.base_url, update.issue_id)
+                    queue = self._pending.setdefault(key, deque())
+                    queue.appendleft(update._replace(attempt=attempt, not_before=time.time() + delay))
+                    self._pending.move_to_end(key)
+                return
+
+            message = f"Could not update Jira issue {update.issue_id}: {e}"
+            print(message)
+            if update.on_error is not None:
+                try:
+                    update.on_error(message)
+                except Exception as callback_error:
+                    print(f"Could not report the failed Jira update: {callback_error}")
@@ -0,0 +1,198 @@
+import datetime
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from config import JOB_MAX_WORKERS, FEEDBACK_TIMEOUT_SECONDS
+from jobs.job_class import Job
+
+
+class FeedbackUnavailable(Exception):
+    """The feedback a job waits for will not come: the wait timed out or the client disconnected."""
+
+
+class FeedbackChannel:
+    """
+    Per-job mailbox for user feedback, so a reply from the client only wakes the job it belongs to. A wait ends with
+    FeedbackUnavailable after `timeout` seconds, or as soon as the channel is cancelled.
+    """
+
+    def __init__(self, timeout=FEEDBACK_TIMEOUT_SECONDS):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._events = {}
+        self._values = {}
+        self._cancel_reason = None
+
+    def _event(self, kind):
+        with self._lock:
+            return self._events.setdefault(kind, threading.Event())
+
+    def send(self, kind, value):
+        with self._lock:
+            self._values[kind] = value
+        self._event(kind).set()
+
+    def cancel(self, reason):
+        """Wake up every (current and future) wait with FeedbackUnavailable."""
+        with self._lock:
+            self._cancel_reason = reason
+            events = list(self._events.values())
+        for event in events:
+            event.set()
+
+    def wait(self, kind):
+        """Block until feedback of this kind arrives and return it."""
+        event = self._event(kind)
+        with self._lock:
+            if self._cancel_reason is not None:
+                raise FeedbackUnavailable(self._cancel_reason)
+        if not event.wait(self.timeout):
+            raise FeedbackUnavailable(f"No {kind} feedback received within {self.timeout // 60} minutes")
+        with self._lock:
+            if kind not in self._values:
+                raise FeedbackUnavailable(self._cancel_reason)
+            event.clear()
+            return self._values.pop(kind)
+
+
+class JobSocket:
+    """Emits socket events to the client that started a job only, tagged with the job id."""
+
+    def __init__(self, socketio, sid, job_id):
+        self.socketio = socketio
+        self.sid = sid
+        self.job_id = job_id
+
+    def emit(self, event, data=None):
+        payload = dict(data or {})
+        payload['job_id'] = self.job_id
+        self.socketio.emit(event, payload, to=self.sid)
+
+
+class JobManager:
+    """
+    Runs user stories as background jobs on a worker pool.
+
+    Jobs are stored in the `jobs` table and every job gets its own FeedbackChannel and JobSocket. Only one job at a
+    time works on the same codebase (and git repository): the jobs of a project wait in a queue of their own and
+    the next one is handed to the pool when the previous one finishes, so waiting jobs never occupy a worker. Jobs
+    of different projects run in parallel.
+    """
+
+    def __init__(self, app, socketio, max_workers=JOB_MAX_WORKERS):
+        self.app = app
+        self.socketio = socketio
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._channels = {}
+        self._sids = {}  # job id -> client that started it, for jobs that are queued or running
+        self._project_queues = {}  # project name -> deque of jobs waiting for the running one, for busy projects
+
+    def recover(self):
+        """Mark jobs that were queued or running when the server stopped as interrupted."""
+        with self.app.db_manager.session_scope() as session:
+            session.query(Job).filter(Job.status.in_(['queued', 'running'])).update(
+                {Job.status: 'interrupted', Job.finished_at: datetime.datetime.now()}, synchronize_session=False)
+
+    def submit(self, target, sid, project_name, user_id, jira_id, user_story):
+        """
+        Queue a job and return its id straight away. `target(job_socket, channel)` runs on a worker thread, inside
+        an application context.
+        """
+        job = Job(project_name=project_name, user_id=user_id, jira_id=jira_id, user_story=user_story)
+        job_id = job.id
+        with self.app.db_manager.session_scope() as session:
+            session.add(job)
+
+        job_socket = JobSocket(self.socketio, sid, job_id)
+        with self._lock:
+            self._channels[job_id] = FeedbackChannel()
+            self._sids[job_id] = sid
+            queue = self._project_queues.get(project_name)
+            if queue is None:
+                self._project_queues[project_name] = deque()
+            else:
+                queue.append((job_id, target, job_socket))
+
+        if queue is None:
+            self.executor.submit(self._run, job_id, project_name, target, job_socket)
+        else:
+            job_socket.emit('script_output', {'data': "Another user story is running for this project, "
+                                                      "this one will start when it is done.."})
+        return job_id
+
+    def send_feedback(self, job_id, kind, value):
+        with self._lock:
+            channel = self._channels.get(job_id)
+        if channel is None:
+            print(f"Received {kind} feedback for unknown or finished job {job_id}.")
+            return False
+        channel.send(kind, value)
+        return True
+
+    def cancel_client_jobs(self, sid):
+        """
+        The client `sid` disconnected: its queued jobs are dropped and its running jobs stop at their next wait for
+        feedback. Both are marked interrupted; the user story can be resumed from its last completed stage.
+        """
+        with self._lock:
+            job_ids = [job_id for job_id, job_sid in self._sids.items() if job_sid == sid]
+            dropped = []
+            for queue in self._project_queues.values():
+                for job in [job for job in queue if job[0] in job_ids]:
+                    queue.remove(job)
+                    dropped.append(job[0])
+            for job_id in dropped:
+                self._channels.pop(job_id, None)
+                self._sids.pop(job_id, None)
+            running = [self._channels[job_id] for job_id in job_ids
+                       if job_id not in dropped and job_id in self._channels]
+
+        for job_id in dropped:
+            self._set_status(job_id, 'interrupted', finished_at=datetime.datetime.now())
+        for channel in running:
+            channel.cancel("The client disconnected")
+
+    def _start_next(self, project_name):
+        """Hand the next queued job of a project to the pool, or mark the project idle when there is none."""
+        with self._lock:
+            queue = self._project_queues[project_name]
+            if not queue:
+                del self._project_queues[project_name]
+                return
+            job_id, target, job_socket = queue.popleft()
+        self.executor.submit(self._run, job_id, project_name, target, job_socket)
+
+    def _set_status(self, job_id, status, **fields):
+        with self.app.db_manager.session_scope() as session:
+            job = session.get(Job, job_id)
+            job.status = status
+            for name, value in fields.items():
+                setattr(job, name, value)
+
+    def _run(self, job_id, project_name, target, job_socket):
+        with self.app.app_context():
+            try:
+                self._set_status(job_id, 'running', started_at=datetime.datetime.now())
+                with self._lock:
+                    channel = self._channels[job_id]
+                target(job_socket, channel)
+                self._set_status(job_id, 'done', finished_at=datetime.datetime.now())
+            except FeedbackUnavailable as e:
+                self._set_status(job_id, 'interrupted', error=str(e), finished_at=datetime.datetime.now())
+                job_socket.emit('script_output', {'data': f"Running the user story was interrupted: {e}"})
+                job_socket.emit('job_failed', {'error': str(e)})
+                job_socket.emit('enable_drop_object')
+            except Exception as e:
+                traceback.print_exc()
+                self._set_status(job_id, 'failed', error=str(e), finished_at=datetime.datetime.now())
+                job_socket.emit('script_output', {'data': f"Running the user story failed: {e}"})
+                job_socket.emit('job_failed', {'error': str(e)})
+                job_socket.emit('enable_drop_object')
+            finally:
+                with self._lock:
+                    self._channels.pop(job_id, None)
+                    self._sids.pop(job_id, None)
+                self._start_next(project_name)
@@ -0,0 +1,215 @@
+import os
+import hashlib
+import threading
+from collections import namedtuple
+
+from utils.ignore_matcher import IgnoreMatcher, git_visible_files
+
+# One file of the scanned repository. `relative_path` uses '/' separators; `hash` is the sha256 of the raw
+# content and is only computed for files that are not ignored.
+FileEntry = namedtuple('FileEntry', ['path', 'relative_path', 'size', 'mtime', 'is_binary', 'hash', 'ignored'])
+
+
+class RepoManifest:
+    """Result of a single traversal of a repository: all files plus the directory tree they were found in."""
+
+    def __init__(self, directory, files, children, errors):
+        self.directory = directory
+        self.files = files
+        self.children = children
+        self.errors = errors
+        self._by_relative_path = {entry.relative_path: entry for entry in files}
+
+    def get(self, relative_path):
+        return self._by_relative_path.get(relative_path)
+
+    def included_files(self):
+        """Files that are not ignored and contain text, in sorted path order."""
+        return [entry for entry in self.files if not entry.ignored and not entry.is_binary]
+
+    def folder_structure(self):
+        """Render the directory tree as an indented listing (directories end with '/')."""
+        if '' not in self.children and '' not in self.errors:
+            # The root directory itself is ignored
+            return ""
+        result = []
+
+        def render(relative_dir, indent):
+            name = os.path.basename(self.directory) if relative_dir == '' else relative_dir.rsplit('/', 1)[-1]
+            result.append(f"{indent}{name}/")
+            for child, is_dir in self.children.get(relative_dir, []):
+                child_path = f"{relative_dir}/{child}" if relative_dir else child
+                if is_dir:
+                    render(child_path, indent + "  ")
+                else:
+                    result.append(f"{indent}  {child}")
+            if relative_dir in self.errors:
+                result.append(f"{indent}  {self.errors[relative_dir]}")
+
+        render('', "")
+        return "\n".join(result)
+
+
+def is_binary_content(content):
+    return b'\0' in content[:8192]
+
+
+def _read_entry(path, relative_path, size, mtime):
+    with open(path, 'rb') as f:
+        content = f.read()
+    return FileEntry(path, relative_path, size, mtime, is_binary_content(content),
+                     hashlib.sha256(content).hexdigest(), False)
+
+
+# Entries of the previous scan per repository, so unchanged files (same size and mtime) are not read again
+_previous_entries = {}
+_previous_entries_lock = threading.Lock()
+
+
+def scan_repository(directory, matcher, use_gitignore=True):
+    """
+    Walk `directory` once with os.scandir and return a RepoManifest.
+
+    `matcher` is an IgnoreMatcher (a plain ignore configuration dict is compiled on the fly). Ignored directories
+    are skipped entirely. Files matching the ignored files or extensions are listed (they show up in the folder
+    structure) but marked as ignored and never read. When `directory` is a git repository and `use_gitignore` is
+    set, files and directories excluded by its .gitignore are left out as well. Other files are read and hashed,
+    unless their size and mtime are unchanged since the previous scan of the same directory.
+    """
+    if isinstance(matcher, dict):
+        matcher = IgnoreMatcher(matcher)
+
+    visible_files = git_visible_files(directory) if use_gitignore else None
+    visible_dirs = None
+    if visible_files is not None:
+        visible_dirs = {''}
+        for path in visible_files:
+            parts = path.split('/')[:-1]
+            for i in range(1, len(parts) + 1):
+                visible_dirs.add('/'.join(parts[:i]))
+
+    with _previous_entries_lock:
+        previous = _previous_entries.get(directory, {})
+
+    files = []
+    children = {}
+    errors = {}
+
+    def walk(path, relative_dir):
+        try:
+            with os.scandir(path) as iterator:
+                entries = sorted(iterator, key=lambda e: e.name)
+        except PermissionError:
+            errors[relative_dir] = "[Permission Denied]"
+            return
+        except Exception as e:
+            errors[relative_dir] = f"[Error: {str(e)}]"
+            return
+
+        listing = []
+        for entry in entries:
+            relative_path = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if matcher.ignores_directory(entry.name, relative_path) or \
+                        (visible_dirs is not None and relative_path not in visible_dirs):
+                    continue
+                listing.append((entry.name, True))
+                walk(entry.path, relative_path)
+                continue
+
+            if visible_files is not None and relative_path not in visible_files:
+                continue
+            listing.append((entry.name, False))
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+
+            if matcher.ignores_file(entry.name, relative_path):
+                files.append(FileEntry(entry.path, relative_path, stat.st_size, stat.st_mtime, False, None, True))
+                continue
+
+            old = previous.get(relative_path)
+            if old and not old.ignored and old.size == stat.st_size and old.mtime == stat.st_mtime:
+                files.append(old)
+                continue
+            try:
+                files.append(_read_entry(entry.path, relative_path, stat.st_size, stat.st_mtime))
+            except OSError:
+                continue
+        children[relative_dir] = listing
+
+    if not matcher.ignores_directory(os.path.basename(directory)):
+        walk(directory, '')
+
+    files.sort(key=lambda entry: entry.relative_path)
+    with _previous_entries_lock:
+        _previous_entries[directory] = {entry.relative_path: entry for entry in files}
+
+    return RepoManifest(directory, files, children, errors)
+
+
+def rescan_paths(manifest, relative_paths, matcher):
+    """
+    Return a copy of `manifest` in which only the files in `relative_paths` ('/'-separated, relative to the
+    repository root) are scanned again: new files are added, changed files re-read and deleted files removed, so
+    keeping a manifest current after a known set of changes costs time in the size of that set.
+    """
+    if isinstance(matcher, dict):
+        matcher = IgnoreMatcher(matcher)
+
+    entries = {entry.relative_path: entry for entry in manifest.files}
+    children = {directory: list(listing) for directory, listing in manifest.children.items()}
+
+    def remove_listing(relative_path):
+        directory, _, name = relative_path.rpartition('/')
+        if directory not in children:
+            return
+        children[directory] = [child for child in children[directory] if child[0] != name]
+        # Drop directories that were removed together with their last file
+        if directory and not children[directory] and \
+                not os.path.isdir(os.path.join(manifest.directory, *directory.split('/'))):
+            del children[directory]
+            remove_listing(directory)
+
+    def ensure_directory(directory):
+        # Returns False when the directory (or one of its parents) is ignored
+        if directory in children:
+            return True
+        if not directory:
+            return False
+        parent, _, name = directory.rpartition('/')
+        if matcher.ignores_directory(name, directory) or not ensure_directory(parent):
+            return False
+        children[parent] = sorted(children[parent] + [(name, True)])
+        children[directory] = []
+        return True
+
+    for relative_path in relative_paths:
+        entries.pop(relative_path, None)
+        remove_listing(relative_path)
+
+        path = os.path.join(manifest.directory, *relative_path.split('/'))
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # Deleted
+            continue
+        directory, _, name = relative_path.rpartition('/')
+        if not os.path.isfile(path) or not ensure_directory(directory):
+            continue
+        children[directory] = sorted(children[directory] + [(name, False)])
+
+        if matcher.ignores_file(name, relative_path):
+            entries[relative_path] = FileEntry(path, relative_path, stat.st_size, stat.st_mtime, False, None, True)
+            continue
+        try:
+            entries[relative_path] = _read_entry(path, relative_path, stat.st_size, stat.st_mtime)
+        except OSError:
+            continue
+
+    files = sorted(entries.values(), key=lambda entry: entry.relative_path)
+    with _previous_entries_lock:
+        _previous_entries[manifest.directory] = {entry.relative_path: entry for entry in files}
+
+    return RepoManifest(manifest.directory, files, children, dict(manifest.errors))
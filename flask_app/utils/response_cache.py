@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from config import RESPONSE_CACHE_PATH, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS
+
+
+class ResponseCache:
+    """
+    Persistent cache for LLM responses of deterministic (temperature 0) prompts, stored in the application's
+    SQLite database.
+
+    Entries are keyed by a hash of the prompt template (name and text), the model parameters and the prompt
+    inputs, so changing any of them is a miss. Entries expire after `ttl_seconds`; when the table grows beyond
+    `max_entries`, the least recently used rows are evicted. Hits and misses are counted per process.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                 ttl_seconds=RESPONSE_CACHE_TTL_SECONDS):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # The database is shared with SQLAlchemy, so wait for its writes instead of failing on a locked database
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS llm_responses (
+                key TEXT PRIMARY KEY,
+                template TEXT NOT NULL,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS ix_llm_responses_last_used ON llm_responses (last_used)")
+        self._connection.commit()
+        self._count = self._connection.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(template_name, template, params, inputs):
+        payload = json.dumps({'template_name': template_name,
+                              'template': hashlib.sha256(template.encode('utf-8')).hexdigest(),
+                              'params': params,
+                              'inputs': inputs}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8', errors='ignore')).hexdigest()
+
+    def get(self, key):
+        """Return the cached response, or None when it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT response, created_at FROM llm_responses WHERE key = ?",
+                                           (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                self._connection.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                self._count -= 1
+                row = None
+            if row is None:
+                self.misses += 1
+                self._connection.commit()
+                return None
+
+            self.hits += 1
+            self._connection.execute("UPDATE llm_responses SET last_used = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+            return row[0]
+
+    def put(self, key, template_name, model, response):
+        now = time.time()
+        with self._lock:
+            cursor = self._connection.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, template, model, response, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (key, template_name, model, response, now, now))
+            self._count += max(cursor.rowcount, 0)
+
+            if self._count > self.max_entries:
+                # Drop expired entries first, then the least recently used ones (an extra 10% at once)
+                self._connection.execute("DELETE FROM llm_responses WHERE created_at < ?", (now - self.ttl_seconds,))
+                self._count = self._connection.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+            if self._count > self.max_entries:
+                to_evict = self._count - int(self.max_entries * 0.9)
+                self._connection.execute(
+                    "DELETE FROM llm_responses WHERE key IN "
+                    "(SELECT key FROM llm_responses ORDER BY last_used LIMIT ?)", (to_evict,))
+                self._count = self._connection.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+            self._connection.commit()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': self._count}
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Return the process-wide response cache, creating it on first use."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache()
+        return _default_cache
+
+
+def cached_invoke(template_name, template, params, chain, inputs, use_cache=True):
+    """
+    Invoke `chain` with `inputs` and return the response content, using the response cache unless `use_cache` is
+    off. `params` are the model parameters that influence the output (model name, temperature, top_p, ...).
+    """
+    if not use_cache:
+        return chain.invoke(inputs).content
+
+    cache = get_response_cache()
+    key = cache.make_key(template_name, template, params, inputs)
+    response = cache.get(key)
+    if response is None:
+        response = chain.invoke(inputs).content
+        cache.put(key, template_name, params.get('model_name', ''), response)
+    return response
@@ -0,0 +1,44 @@
+import time
+import random
+
+import openai
+
+TRANSIENT_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+def is_transient_error(error):
+    """Rate limits, server errors, timeouts and connection problems are worth retrying; anything else is not."""
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError,
+                          openai.InternalServerError, ConnectionError, TimeoutError)):
+        return True
+
+    # Jira (JIRAError.status_code), Pinecone (ApiException.status) and HTTP client errors expose a status code
+    for attribute in ('status_code', 'status'):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int):
+            return status in TRANSIENT_STATUS_CODES
+    return False
+
+
+def backoff_delay(attempt, base_delay=2, max_delay=60):
+    """Seconds to wait before retry number `attempt` (1-based): exponential, capped, with some jitter."""
+    return min(max_delay, base_delay * 2 ** (attempt - 1)) * random.uniform(0.8, 1.2)
+
+
+def call_with_retries(fn, retries=3, base_delay=2, max_delay=60, on_retry=None):
+    """
+    Call `fn()` and retry it with exponential backoff (plus jitter) when it raises a transient error.
+    `on_retry(attempt, error, delay)` is called before every retry. Non-transient errors are raised immediately.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return fn()
+        except Exception as e:
+            if attempt > retries or not is_transient_error(e):
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            if on_retry is not None:
+                on_retry(attempt, e, delay)
+            time.sleep(delay)
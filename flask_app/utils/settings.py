@@ -0,0 +1,99 @@
+import os
+import json
+import threading
+import configparser
+from collections import namedtuple
+
+from config import CONFIG_PATH
+
+DEFAULT_MODELS = {'simple_task_model': "gpt-4o-mini", 'hard_task_model': "gpt-4o"}
+VECTOR_BACKENDS = ('pinecone', 'local')
+
+# Validated contents of config.ini
+Settings = namedtuple('Settings', ['openai_api_key', 'pinecone_api_key', 'vector_backend', 'models',
+                                   'jira_base_url', 'jira_username', 'jira_password',
+                                   'langchain_api_key', 'langchain_tracing', 'langchain_project', 'disable_login'])
+
+
+def parse_settings(config):
+    """Turn the DEFAULT section of a ConfigParser into Settings, falling back to defaults for invalid values."""
+    section = config['DEFAULT']
+
+    try:
+        models = json.loads(section.get('models', json.dumps(DEFAULT_MODELS)))
+    except json.JSONDecodeError:
+        print("Warning: Invalid JSON for 'models' in config file. Using the default models.")
+        models = {}
+    if not isinstance(models, dict):
+        print("Warning: 'models' in config file is not a JSON object. Using the default models.")
+        models = {}
+    models = {**DEFAULT_MODELS, **models}
+
+    vector_backend = section.get('VECTOR_BACKEND', 'pinecone')
+    if vector_backend not in VECTOR_BACKENDS:
+        print(f"Warning: Unknown VECTOR_BACKEND '{vector_backend}' in config file. Using 'pinecone'.")
+        vector_backend = 'pinecone'
+
+    def boolean(name, fallback):
+        try:
+            return section.getboolean(name, fallback=fallback)
+        except ValueError:
+            print(f"Warning: Invalid value for '{name}' in config file. Using {fallback}.")
+            return fallback
+
+    return Settings(openai_api_key=section.get('OPENAI_API_KEY', ''),
+                    pinecone_api_key=section.get('PINECONE_API_KEY', ''),
+                    vector_backend=vector_backend,
+                    models=models,
+                    jira_base_url=section.get('JIRA_URL', ''),
+                    jira_username=section.get('JIRA_USERNAME', ''),
+                    jira_password=section.get('JIRA_PASSWORD', ''),
+                    langchain_api_key=section.get('LANGCHAIN_API_KEY', ''),
+                    langchain_tracing=boolean('LANGCHAIN_TRACING_V2', False),
+                    langchain_project=section.get('LANGCHAIN_PROJECT', ''),
+                    disable_login=boolean('disable_login', True))
+
+
+class SettingsService:
+    """
+    Keeps the parsed settings of config.ini in memory. The file is only parsed again when its mtime changes or
+    after `invalidate()` (called when the settings are saved), so request handlers don't read it on every hit.
+
+    Runs get an immutable Settings snapshot passed explicitly, API keys included. Only the LangSmith tracing
+    variables (which LangChain reads from the environment) are exported, once per load instead of on every page
+    load.
+    """
+
+    def __init__(self, path=CONFIG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._settings = None
+        self._mtime = None
+
+    def _current_mtime(self):
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    def get(self):
+        mtime = self._current_mtime()
+        with self._lock:
+            if self._settings is None or mtime != self._mtime:
+                config = configparser.ConfigParser()
+                config.read(self.path)
+                self._settings = parse_settings(config)
+                self._mtime = mtime
+                self._apply(self._settings)
+            return self._settings
+
+    def invalidate(self):
+        with self._lock:
+            self._settings = None
+
+    @staticmethod
+    def _apply(settings):
+        os.environ["LANGCHAIN_ENDPOINT"] = "https://api.smith.langchain.com"
+        os.environ["LANGCHAIN_API_KEY"] = settings.langchain_api_key
+        os.environ["LANGCHAIN_TRACING_V2"] = 'true' if settings.langchain_tracing else 'false'
+        os.environ["LANGCHAIN_PROJECT"] = settings.langchain_project
@@ -0,0 +1,235 @@
+import os
+import re
+import ast
+import json
+import threading
+
+from langchain_core.documents import Document
+
+from config import DATABASE_PATH
+from utils.code_chunker import EXTENSIONS
+
+# Definitions in languages without a parser here: functions, classes and arrow functions assigned to a name
+REGEX_PATTERNS = [
+    re.compile(r'^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*([A-Za-z_$][\w$]*)'),
+    re.compile(r'^\s*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?(?:public\s+|private\s+)?'
+               r'(?:class|interface|struct|enum|trait|module)\s+([A-Za-z_$][\w$]*)'),
+    re.compile(r'^\s*(?:export\s+)?(?:const|let|var)\s+([A-Za-z_$][\w$]*)\s*=\s*(?:async\s*)?'
+               r'(?:function\b|\([^)]*\)\s*=>|[A-Za-z_$][\w$]*\s*=>)'),
+    re.compile(r'^\s*(?:pub\s+)?(?:def|fn|func|sub)\s+(?:\([^)]*\)\s*)?([A-Za-z_][\w]*[?!]?)'),
+]
+
+IDENTIFIER = re.compile(r'[A-Za-z_$][\w$]*(?:\.[A-Za-z_$][\w$]*)*')
+QUOTED = re.compile(r'[\'"`]([A-Za-z_$][\w$.]*)(?:\(\))?[\'"`]')
+
+
+def _python_symbols(text):
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        return None
+
+    symbols = []
+
+    def visit(node, prefix):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                qualified_name = f"{prefix}{child.name}"
+                start = min([child.lineno] + [decorator.lineno for decorator in child.decorator_list])
+                kind = 'class' if isinstance(child, ast.ClassDef) else 'function'
+                symbols.append({'name': qualified_name, 'kind': kind, 'start': start, 'end': child.end_lineno})
+                visit(child, f"{qualified_name}.")
+
+    visit(tree, '')
+    return symbols
+
+
+def _block_end(lines, start):
+    """Line number of the brace that closes the block opened on (or right after) line `start`, or None."""
+    depth = 0
+    opened = False
+    for number in range(start, len(lines) + 1):
+        for char in lines[number - 1]:
+            if char == '{':
+                depth += 1
+                opened = True
+            elif char == '}':
+                depth -= 1
+                if opened and depth == 0:
+                    return number
+        if not opened and number - start >= 2:
+            return None
+    return None
+
+
+def _regex_symbols(text):
+    lines = text.split('\n')
+    starts = []
+    for number, line in enumerate(lines, start=1):
+        for pattern in REGEX_PATTERNS:
+            match = pattern.match(line)
+            if match:
+                starts.append((number, match.group(1)))
+                break
+
+    symbols = []
+    for i, (start, name) in enumerate(starts):
+        end = _block_end(lines, start)
+        if end is None:
+            # No braces (e.g. Ruby): the definition runs until the next one
+            end = starts[i + 1][0] - 1 if i + 1 < len(starts) else len(lines)
+        symbols.append({'name': name, 'kind': 'definition', 'start': start, 'end': max(start, end)})
+    return symbols
+
+
+def extract_symbols(relative_path, text):
+    """Return the definitions in a source file as dicts with qualified name, kind and (1-based) line range."""
+    language, _, content_type = EXTENSIONS.get(os.path.splitext(relative_path)[1].lower(), ('text', None, 'text'))
+    if content_type != 'code':
+        return []
+    if language == 'python':
+        symbols = _python_symbols(text)
+        if symbols is not None:
+            return symbols
+    return _regex_symbols(text)
+
+
+class SymbolIndex:
+    """
+    Maps qualified symbol names (e.g. `Codebase.update_summary`) to their file and line range, so code that an
+    instruction names explicitly can be read straight from disk instead of searched for in the vector database.
+
+    The index is persisted under `DATABASE_PATH/symbol_indexes` and updated from a repository scan: only files whose
+    content hash changed are parsed again.
+    """
+
+    def __init__(self, directory, index_name, base_dir=os.path.join(DATABASE_PATH, 'symbol_indexes')):
+        self.directory = directory
+        self.path = os.path.join(base_dir, f"{index_name}.json")
+        self._lock = threading.Lock()
+        self._files = self._load()
+        self._build_lookup()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._files, f)
+        os.replace(tmp_path, self.path)
+
+    def _build_lookup(self):
+        # Every symbol can be found by its qualified name and by its last name part
+        self._by_name = {}
+        for relative_path, entry in self._files.items():
+            for symbol in entry['symbols']:
+                found = (relative_path, symbol)
+                self._by_name.setdefault(symbol['name'], []).append(found)
+                short_name = symbol['name'].rsplit('.', 1)[-1]
+                if short_name != symbol['name']:
+                    self._by_name.setdefault(short_name, []).append(found)
+
+    def update(self, manifest, relative_paths=None):
+        """
+        Bring the index in line with a repository scan (RepoManifest); with `relative_paths` given only those files
+        are compared. Returns the number of files parsed.
+        """
+        with self._lock:
+            if relative_paths is None:
+                files = {}
+                candidates = manifest.included_files()
+            else:
+                files = {path: entry for path, entry in self._files.items() if path not in relative_paths}
+                candidates = [file_entry for file_entry in map(manifest.get, sorted(relative_paths))
+                              if file_entry and not file_entry.ignored and not file_entry.is_binary]
+
+            parsed = 0
+            for file_entry in candidates:
+                entry = self._files.get(file_entry.relative_path)
+                if entry and entry['hash'] == file_entry.hash:
+                    files[file_entry.relative_path] = entry
+                    continue
+                try:
+                    with open(file_entry.path, 'r', encoding='utf-8', errors='ignore') as f:
+                        symbols = extract_symbols(file_entry.relative_path, f.read())
+                except OSError:
+                    continue
+                files[file_entry.relative_path] = {'hash': file_entry.hash, 'symbols': symbols}
+                parsed += 1
+
+            changed = parsed or set(files) != set(self._files)
+            self._files = files
+            if changed:
+                self._build_lookup()
+                self._save()
+        print(f"Symbol index updated: {parsed} file(s) parsed.")
+        return parsed
+
+    def lookup(self, name, file=None):
+        """Return (relative path, symbol) pairs for a (qualified) name, optionally only in files named `file`."""
+        with self._lock:
+            found = list(self._by_name.get(name, []))
+        if file:
+            found = [(path, symbol) for path, symbol in found if os.path.basename(path) == file or path == file]
+        return found
+
+    def find_docs(self, text, file=None, max_symbols=2, max_chars=8000):
+        """
+        Resolve the symbols named in an instruction line (`text`) to Documents with their code, read from disk.
+
+        Quoted names (e.g. 'example_function') are tried first, then other identifiers, longest first. Without a
+        file, only names that look like code (containing '_', '.' or an inner capital) are considered, and only when
+        they are unique in the codebase. Returns an empty list when nothing matches, so the caller can fall back
+        to a vector search.
+        """
+        if file:
+            # The file name itself is not a code construct
+            text = text.replace(file, ' ')
+        candidates = list(dict.fromkeys(QUOTED.findall(text)))
+        for identifier in sorted(set(IDENTIFIER.findall(text)), key=len, reverse=True):
+            if identifier in candidates:
+                continue
+            if file or '_' in identifier or '.' in identifier or re.search(r'[a-z][A-Z]', identifier):
+                candidates.append(identifier)
+
+        docs = []
+        seen = set()
+        for name in candidates:
+            found = self.lookup(name, file=file)
+            if not found or (not file and len(found) > 1):
+                continue
+            for relative_path, symbol in found[:1]:
+                key = (relative_path, symbol['name'])
+                if key in seen:
+                    continue
+                doc = self._read(relative_path, symbol, max_chars)
+                if doc is not None:
+                    seen.add(key)
+                    docs.append(doc)
+            if len(docs) >= max_symbols:
+                break
+        return docs
+
+    def _read(self, relative_path, symbol, max_chars):
+        path = os.path.join(self.directory, relative_path)
+        try:
+            with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                lines = f.read().split('\n')
+        except OSError:
+            return None
+
+        content = "\n".join(lines[symbol['start'] - 1:symbol['end']])
+        if not content.strip() or len(content) > max_chars:
+            # Large definitions (e.g. whole classes) are better served by the more focused vector search
+            return None
+        return Document(page_content=content,
+                        metadata={'source': path, 'file': os.path.basename(path), 'path': relative_path,
+                                  'symbol': symbol['name'], 'content_type': 'code', 'kind': symbol['kind'],
+                                  'start_line': symbol['start'], 'end_line': symbol['end'],
+                                  'chunk_id': f"{relative_path}:{symbol['name']}"})
@@ -0,0 +1,370 @@
+import os
+import json
+import time
+import threading
+from abc import ABC, abstractmethod
+
+import numpy as np
+from pinecone import ServerlessSpec
+from langchain_core.documents import Document
+
+from config import DATABASE_PATH
+from utils.client_registry import get_pinecone_client, get_pinecone_index, forget_pinecone_index
+
+
+class VectorBackend(ABC):
+    """
+    Storage interface used by VectorDBIntegration. Embedding happens in VectorDBIntegration, so backends only
+    store and search vectors, together with the chunk text and its metadata.
+    """
+
+    @abstractmethod
+    def exists(self):
+        pass
+
+    @abstractmethod
+    def create(self):
+        pass
+
+    @abstractmethod
+    def drop(self):
+        pass
+
+    @abstractmethod
+    def is_populated(self):
+        pass
+
+    @abstractmethod
+    def upsert(self, ids, vectors, documents):
+        pass
+
+    @abstractmethod
+    def delete(self, ids):
+        pass
+
+    @abstractmethod
+    def search(self, vector, k, filter=None):
+        """Return the `k` most similar documents, optionally restricted to exact metadata matches in `filter`."""
+
+    @abstractmethod
+    def flush(self):
+        """Persist the writes done by upsert/delete (backends may gather them until then)."""
+
+
+class PineconeBackend(VectorBackend):
+    def __init__(self, api_key, index_name, dimension=1536, text_key='text'):
+        self.api_key = api_key
+        self.index_name = index_name
+        self.dimension = dimension
+        self.text_key = text_key
+        self.pc = get_pinecone_client(api_key)
+
+    @property
+    def index(self):
+        return get_pinecone_index(self.api_key, self.index_name)
+
+    def exists(self):
+        return self.index_name in self.pc.list_indexes().names()
+
+    def create(self, timeout=120):
+        self.pc.create_index(self.index_name, dimension=self.dimension,
+                             metric='cosine',
+                             spec=ServerlessSpec(
+                                 cloud='aws',
+                                 region='us-east-1'
+                             ))
+        # Wait until Pinecone reports the new index as ready before populating it
+        deadline = time.time() + timeout
+        while not self.pc.describe_index(self.index_name).status['ready'] and time.time() < deadline:
+            time.sleep(1)
+
+    def drop(self):
+        self.pc.delete_index(self.index_name)
+        forget_pinecone_index(self.api_key, self.index_name)
+
+    def is_populated(self):
+        return self.index.describe_index_stats().total_vector_count > 0
+
+    def upsert(self, ids, vectors, documents, batch_size=100):
+        index = self.index
+        for i in range(0, len(ids), batch_size):
+            index.upsert(vectors=[
+                {'id': id_, 'values': vector, 'metadata': {**doc.metadata, self.text_key: doc.page_content}}
+                for id_, vector, doc in zip(ids[i:i + batch_size], vectors[i:i + batch_size],
+                                            documents[i:i + batch_size])
+            ])
+
+    def delete(self, ids, batch_size=1000):
+        index = self.index
+        for i in range(0, len(ids), batch_size):
+            index.delete(ids=ids[i:i + batch_size])
+
+    def flush(self):
+        # Pinecone writes are sent right away
+        pass
+
+    def search(self, vector, k, filter=None):
+        response = self.index.query(vector=vector, top_k=k, filter=filter, include_metadata=True)
+
+        docs = []
+        for match in response.matches:
+            metadata = dict(match.metadata)
+            text = metadata.pop(self.text_key, '')
+            metadata.setdefault('chunk_id', match.id)
+            docs.append(Document(page_content=text, metadata=metadata))
+        return docs
+
+
+class LocalBackend(VectorBackend):
+    """
+    In-process cosine-similarity index, persisted under `DATABASE_PATH/vector_indexes/<index_name>`.
+
+    Vectors are stored normalized in a float32 `.npy` file that is memory-mapped on load; chunk ids, texts and
+    metadata live in a JSON file next to it. Small indexes are searched exhaustively (flat). Once an index holds
+    `ivf_threshold` vectors or more, an IVF partitioning is built (k-means centroids, one inverted list per
+    centroid) and queries only score the `nprobe` closest lists. Metadata-filtered queries score the matching
+    rows exactly, since a filter like `file` already narrows the search to a handful of chunks.
+
+    Upserts and deletes are gathered in memory and applied in one go by `flush()` (or before the next read), so a
+    sync rewrites the files and rebuilds the IVF partitioning once instead of once per batch.
+    """
+
+    def __init__(self, index_name, base_dir=os.path.join(DATABASE_PATH, 'vector_indexes'),
+                 ivf_threshold=20000, nprobe=8):
+        self.index_name = index_name
+        self.path = os.path.join(base_dir, index_name)
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._pending_upserts = {}  # id -> (vector, document), in order of arrival
+        self._pending_deletes = set()
+
+    @property
+    def _vectors_path(self):
+        return os.path.join(self.path, 'vectors.npy')
+
+    @property
+    def _meta_path(self):
+        return os.path.join(self.path, 'meta.json')
+
+    @property
+    def _ivf_path(self):
+        return os.path.join(self.path, 'ivf.npz')
+
+    def exists(self):
+        return os.path.exists(self._meta_path)
+
+    def create(self):
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            self._set_data(np.zeros((0, 0), dtype=np.float32), [], [], [])
+            self._save()
+
+    def drop(self):
+        with self._lock:
+            self._pending_upserts = {}
+            self._pending_deletes = set()
+            for path in (self._vectors_path, self._meta_path, self._ivf_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._loaded = False
+
+    def is_populated(self):
+        with self._lock:
+            self.flush()
+            return len(self._ids) > 0
+
+    def upsert(self, ids, vectors, documents):
+        with self._lock:
+            for id_, vector, doc in zip(ids, vectors, documents):
+                self._pending_deletes.discard(id_)
+                self._pending_upserts.pop(id_, None)
+                self._pending_upserts[id_] = (vector, doc)
+
+    def delete(self, ids):
+        with self._lock:
+            for id_ in ids:
+                self._pending_upserts.pop(id_, None)
+                self._pending_deletes.add(id_)
+
+    def flush(self):
+        """Apply the gathered upserts and deletes, rebuild the IVF partitioning if needed and save the index."""
+        with self._lock:
+            self._load()
+            if not self._pending_upserts and not self._pending_deletes:
+                return
+            upserts, self._pending_upserts = self._pending_upserts, {}
+            deletes, self._pending_deletes = self._pending_deletes, set()
+
+            # Upserted ids replace their existing rows
+            removed = deletes | set(upserts)
+            keep = [i for i, id_ in enumerate(self._ids) if id_ not in removed]
+            parts = [np.asarray(self._vectors[keep])] if keep else []
+            if upserts:
+                parts.append(self._normalize(np.asarray([vector for vector, _ in upserts.values()],
+                                                        dtype=np.float32)))
+            vectors_ = np.vstack(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+
+            documents = [doc for _, doc in upserts.values()]
+            self._set_data(vectors_,
+                           [self._ids[i] for i in keep] + list(upserts),
+                           [self._texts[i] for i in keep] + [doc.page_content for doc in documents],
+                           [self._metadatas[i] for i in keep] + [dict(doc.metadata) for doc in documents])
+            self._save()
+
+    def search(self, vector, k, filter=None):
+        with self._lock:
+            self.flush()
+            if not self._ids:
+                return []
+            query = self._normalize(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+
+            if filter:
+                candidates = self._filter_rows(filter)
+            elif self._centroids is not None:
+                centroid_scores = self._centroids @ query
+                lists = np.argsort(-centroid_scores)[:self.nprobe]
+                candidates = np.flatnonzero(np.isin(self._assignments, lists))
+            else:
+                candidates = None
+
+            if candidates is None:
+                scores = self._vectors @ query
+                rows = np.arange(len(self._ids))
+            else:
+                if len(candidates) == 0:
+                    return []
+                scores = self._vectors[candidates] @ query
+                rows = candidates
+
+            top = np.argsort(-scores)[:k]
+            docs = []
+            for i in top:
+                row = int(rows[i])
+                metadata = dict(self._metadatas[row])
+                metadata.setdefault('chunk_id', self._ids[row])
+                docs.append(Document(page_content=self._texts[row], metadata=metadata))
+            return docs
+
+    def _filter_rows(self, filter):
+        rows = None
+        for key, value in filter.items():
+            matches = set(self._rows_by_key(key).get(value, ()))
+            rows = matches if rows is None else rows & matches
+        return np.array(sorted(rows), dtype=np.int64)
+
+    def _rows_by_key(self, key):
+        # Lazily built inverted index of metadata values, e.g. {'file': {'main.py': [3, 4]}}
+        if key not in self._metadata_index:
+            index = {}
+            for row, metadata in enumerate(self._metadatas):
+                if key in metadata:
+                    index.setdefault(metadata[key], []).append(row)
+            self._metadata_index[key] = index
+        return self._metadata_index[key]
+
+    @staticmethod
+    def _normalize(vectors):
+        if vectors.size == 0:
+            return vectors
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def _set_data(self, vectors, ids, texts, metadatas):
+        self._vectors = vectors
+        self._ids = ids
+        self._texts = texts
+        self._metadatas = metadatas
+        self._metadata_index = {}
+        self._centroids = None
+        self._assignments = None
+        if len(ids) >= self.ivf_threshold:
+            self._build_ivf()
+        self._loaded = True
+
+    def _build_ivf(self, iterations=10, seed=0):
+        """Partition the vectors with a few rounds of spherical k-means (sqrt(n) lists)."""
+        n = self._vectors.shape[0]
+        n_lists = max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+        centroids = np.asarray(self._vectors[rng.choice(n, n_lists, replace=False)])
+        assignments = np.zeros(n, dtype=np.int32)
+
+        for _ in range(iterations):
+            assignments = np.argmax(self._vectors @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = self._vectors[assignments == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = self._normalize(centroids)
+
+        self._centroids = centroids.astype(np.float32)
+        self._assignments = assignments.astype(np.int32)
+
+    def _save(self):
+        os.makedirs(self.path, exist_ok=True)
+
+        # Write to temporary files first, so a crash never leaves a half-written index behind
+        vectors_tmp = self._vectors_path + '.tmp.npy'
+        np.save(vectors_tmp, np.ascontiguousarray(self._vectors, dtype=np.float32))
+        os.replace(vectors_tmp, self._vectors_path)
+
+        if self._centroids is not None:
+            ivf_tmp = self._ivf_path + '.tmp.npz'
+            np.savez(ivf_tmp, centroids=self._centroids, assignments=self._assignments)
+            os.replace(ivf_tmp, self._ivf_path)
+        elif os.path.exists(self._ivf_path):
+            os.remove(self._ivf_path)
+
+        meta_tmp = self._meta_path + '.tmp'
+        with open(meta_tmp, 'w') as f:
+            json.dump({'ids': self._ids, 'texts': self._texts, 'metadatas': self._metadatas}, f)
+        os.replace(meta_tmp, self._meta_path)
+
+        # Continue from the memory-mapped copy, so the vectors are not kept in memory twice
+        self._vectors = np.load(self._vectors_path, mmap_mode='r')
+
+    def _load(self):
+        if self._loaded:
+            return
+        if not self.exists():
+            self.create()
+            return
+
+        with open(self._meta_path, 'r') as f:
+            meta = json.load(f)
+        self._vectors = np.load(self._vectors_path, mmap_mode='r')
+        self._ids = meta['ids']
+        self._texts = meta['texts']
+        self._metadatas = meta['metadatas']
+        self._metadata_index = {}
+        self._centroids = None
+        self._assignments = None
+        if os.path.exists(self._ivf_path):
+            ivf = np.load(self._ivf_path)
+            self._centroids = ivf['centroids']
+            self._assignments = ivf['assignments']
+        self._loaded = True
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def create_backend(backend, index_name, api_key=None):
+    """
+    Return the vector backend configured by name ('pinecone' or 'local'). Backends are shared per index, so a
+    local index is only loaded once per process.
+    """
+    key = (backend, index_name, api_key)
+    with _backends_lock:
+        if key not in _backends:
+            if backend == 'local':
+                _backends[key] = LocalBackend(index_name)
+            elif backend == 'pinecone':
+                _backends[key] = PineconeBackend(api_key, index_name)
+            else:
+                raise ValueError(f"Unknown vector backend: {backend}")
+        return _backends[key]
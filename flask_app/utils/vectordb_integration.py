@@ -1,74 +1,68 @@
 import os
 import re
 import json
-import time
+from concurrent.futures import ThreadPoolExecutor
 
-from config import IGNORE_PATH
+from config import IGNORE_PATH, DATABASE_PATH
 
-from pinecone import ServerlessSpec
-from pinecone.grpc import PineconeGRPC
 from langchain_core.documents import Document
-from langchain_text_splitters import Language, RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_pinecone import PineconeVectorStore
 
+from utils.client_registry import get_embeddings
+from utils.code_chunker import chunk_document, CHUNKER_VERSION
+from utils.vector_backends import create_backend
+from utils.repo_scanner import scan_repository
+from utils.ignore_matcher import load_ignore_matcher
 
-def load_docs(directory):
+
+def load_docs(directory, manifest=None, relative_paths=None):
     """
     Args:
         directory (str): The root directory from which to load documents.
+        manifest (RepoManifest): Scan of `directory` to reuse; the directory is scanned when not given.
+        relative_paths (set): Only load these files (relative to `directory`), when given.
 
     Returns:
         list: A list of `Document` objects, each containing the text content of a file
               and metadata about its source.
 
-    This function recursively searches the specified directory and its subdirectories
-    for text files, loading their contents into a list of `Document` objects. It excludes
-    files and directories based on the configurations in IGNORE_PATH.
+    This function loads the text files found in the repository scan of the specified directory into a list of
+    `Document` objects. It excludes files and directories based on the configurations in IGNORE_PATH.
     """
-
-    # Load ignore configurations from IGNORE_PATH
-    with open(IGNORE_PATH, 'r') as f:
-        ignore = json.load(f)
+    if manifest is None:
+        # Scan with the ignore configurations from IGNORE_PATH
+        manifest = scan_repository(directory, load_ignore_matcher(IGNORE_PATH))
 
     docs = []
+    for entry in manifest.included_files():
+        if relative_paths is not None and entry.relative_path not in relative_paths:
+            continue
 
-    # Recursively traverse the directory and its subdirectories
-    for root, dirs, files in os.walk(directory):
-        # Skip directories specified
-        dirs[:] = [d for d in dirs if d not in ignore['ignored_directories']]
-
-        for file in files:
-            # Skip files with extensions in the 'ignored_extensions' list or specific ignored files
-            if any(file.endswith(ext) for ext in ignore['ignored_extensions']) or file in ignore['ignored_files']:
-                continue
-
-            # Create the full path to the current file
-            path = os.path.join(root, file)
-
-            # Open the file and read its content
-            with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-                # Create a Document object with metadata and text content
-                docs.append(Document(metadata={'source': path, 'file': file}, page_content=f.read()))
+        # Open the file and read its content
+        with open(entry.path, 'r', encoding='utf-8', errors='ignore') as f:
+            # Create a Document object with metadata and text content
+            docs.append(Document(metadata={'source': entry.path, 'file': os.path.basename(entry.path),
+                                           'path': entry.relative_path},
+                                 page_content=f.read()))
 
     return docs
 
 
-def split_docs(code_files, chunk_size=6000, chunk_overlap=200):
-    """Split the input documents into smaller chunks."""
-    python_splitter = RecursiveCharacterTextSplitter.from_language(
-        language=Language.PYTHON, chunk_size=chunk_size, chunk_overlap=chunk_overlap
-    )
-    docs = python_splitter.split_documents(code_files)
+def split_docs(code_files, chunk_size=2000, chunk_overlap=100):
+    """Split the input documents into syntax-aware chunks, with a splitter per file type (see `chunk_document`)."""
+    docs = []
+    for doc in code_files:
+        docs.extend(chunk_document(doc, doc.metadata.get('path', doc.metadata['file']), chunk_size, chunk_overlap))
     return docs
 
 
 class VectorDBIntegration:
-    def __init__(self, vectordb_api_key, index_name):
+    def __init__(self, vectordb_api_key, index_name, backend='pinecone', openai_api_key=None,
+                 manifest_dir=os.path.join(DATABASE_PATH, 'vector_manifests')):
         self.vectordb_api_key = vectordb_api_key
         self.index_name = self.sanitize_index_name(index_name.lower())
-        self.embeddings = OpenAIEmbeddings()
-        self.pc = PineconeGRPC(api_key=self.vectordb_api_key)
+        self.embeddings = get_embeddings(api_key=openai_api_key)
+        self.backend = create_backend(backend, self.index_name, api_key=self.vectordb_api_key)
+        self.manifest_path = os.path.join(manifest_dir, f"{self.index_name}.{backend}.json")
 
     @staticmethod
     def sanitize_index_name(index_name):
@@ -79,83 +73,181 @@ class VectorDBIntegration:
         return index_name
 
     def index_exists(self):
-        # Get a list of all indexes in Pinecone
-        existing_indexes = self.pc.list_indexes().names()
-
-        # Check if our index name is among them
-        return self.index_name in existing_indexes
+        return self.backend.exists()
 
     def is_index_populated(self):
-        """Check if the Pinecone index is populated by running a sample query."""
-        # Connect to the existing index
-        db = PineconeVectorStore.from_existing_index(self.index_name, self.embeddings)
-
-        # Run a sample query
-        matched_docs = db.similarity_search("function", k=1)
-
-        # Check if any results are returned
-        return len(matched_docs) > 0
+        return self.backend.is_populated()
 
     def create_index(self):
-        self.pc.create_index(self.index_name, dimension=1536,
-                             metric='cosine',
-                             spec=ServerlessSpec(
-                                 cloud='aws',
-                                 region='us-east-1'
-                             ))
-        # Wait to give Pinecone time to process new index before populating
-        time.sleep(10)
-
-    def embed_and_store(self, directory):
-        # Read and split files from codebase
-        print("Embedding and storing codebase to vector database index..")
-        documents = load_docs(directory)
-        splitted_docs = split_docs(documents)
-
-        # Embed split code files and store in vector database
-        index = PineconeVectorStore.from_documents(splitted_docs, self.embeddings, index_name=self.index_name)
+        self.backend.create()
+        # A new index is empty, so a chunk manifest of an earlier (lost) index must not mark files as stored
+        self._remove_manifest()
 
-        return index
+    def embed_and_store(self, directory, manifest=None):
+        # Read and split files from codebase, embed them and store them in the (empty) vector database index
+        print("Embedding and storing codebase to vector database index..")
+        self._remove_manifest()
+        return self.sync_index(directory, manifest=manifest)
+
+    def sync_index(self, directory, manifest=None, batch_size=500, relative_paths=None):
+        """
+        Incrementally bring the index in line with the files in `directory`.
+
+        Every chunk is stored under a stable, content-hashed ID (see `code_chunker.chunk_id`), and the IDs per file
+        are kept in a local manifest. Only chunks of new or changed files that are not in the index yet get embedded
+        and upserted; chunks of removed files and outdated chunks of changed files are deleted. Unchanged files (same
+        content hash in the repository scan) are not read at all. With `relative_paths` given, only those files are
+        compared, added or removed; the rest of the index is left as it is. Without a chunk manifest the whole
+        directory is synced, `relative_paths` or not.
+
+        Returns a dict with the number of upserted and deleted chunks.
+        """
+        chunk_manifest = self._load_manifest()
+        if chunk_manifest is None:
+            chunk_manifest = {}
+            # Vectors stored before IDs were deterministic cannot be matched, so start from an empty index once
+            if self.index_exists() and self.is_index_populated():
+                print("Index has no chunk manifest yet, rebuilding it once..")
+                self.flush_index()
+            # Files outside `relative_paths` are not in the index either, so they are added as well
+            relative_paths = None
+
+        if manifest is None:
+            manifest = scan_repository(directory, load_ignore_matcher(IGNORE_PATH))
+
+        if relative_paths is None:
+            new_chunk_manifest = {}
+            candidates = manifest.included_files()
+        else:
+            new_chunk_manifest = {path: entry for path, entry in chunk_manifest.items() if path not in relative_paths}
+            candidates = [file_entry for file_entry in map(manifest.get, sorted(relative_paths))
+                          if file_entry and not file_entry.ignored and not file_entry.is_binary]
+
+        changed_files = {}
+        for file_entry in candidates:
+            entry = chunk_manifest.get(file_entry.relative_path)
+            if entry and entry['hash'] == file_entry.hash and entry.get('chunker') == CHUNKER_VERSION:
+                new_chunk_manifest[file_entry.relative_path] = entry
+            else:
+                changed_files[file_entry.path] = file_entry
+
+        upsert_docs, upsert_ids, delete_ids = [], [], []
+        for doc in load_docs(directory, manifest=manifest,
+                             relative_paths={file_entry.relative_path for file_entry in changed_files.values()}):
+            file_entry = changed_files[doc.metadata['source']]
+            relative_path = file_entry.relative_path
+            entry = chunk_manifest.get(relative_path)
+
+            chunks = split_docs([doc])
+            ids = [chunk.metadata['chunk_id'] for chunk in chunks]
+            old_ids = set(entry['ids']) if entry else set()
+
+            # Chunks that are already in the index keep their ID, so only new content is embedded
+            for chunk, id_ in zip(chunks, ids):
+                if id_ not in old_ids:
+                    upsert_docs.append(chunk)
+                    upsert_ids.append(id_)
+            delete_ids.extend(old_ids - set(ids))
+            new_chunk_manifest[relative_path] = {'hash': file_entry.hash, 'chunker': CHUNKER_VERSION, 'ids': ids}
+
+        for relative_path in set(chunk_manifest) - set(new_chunk_manifest):
+            delete_ids.extend(chunk_manifest[relative_path]['ids'])
+
+        self.backend.delete(delete_ids)
+        for i in range(0, len(upsert_docs), batch_size):
+            docs = upsert_docs[i:i + batch_size]
+            vectors = self.embeddings.embed_documents([doc.page_content for doc in docs])
+            self.backend.upsert(upsert_ids[i:i + batch_size], vectors, docs)
+        self.backend.flush()
+
+        self._save_manifest(new_chunk_manifest)
+        print(f"Vector index synced: {len(upsert_ids)} chunk(s) upserted, {len(delete_ids)} chunk(s) deleted.")
+        return {'upserted': len(upsert_ids), 'deleted': len(delete_ids)}
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _save_manifest(self, manifest):
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _remove_manifest(self):
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
 
     def flush_index(self):
-        self.pc.delete_index(self.index_name)
+        self.backend.drop()
         self.create_index()
 
     def retrieve_embeddings(self, search_string, k, file=None):
-        code_str = ""
-
-        db = PineconeVectorStore.from_existing_index(self.index_name, self.embeddings)
-
         # Search indexed codebase based on search string
+        vector = self.embeddings.embed_query(search_string)
         if file:
-            matched_docs = db.similarity_search(search_string, k=k, filter={"file": file})
+            matched_docs = self.backend.search(vector, k=k, filter={"file": file})
         else:
-            matched_docs = db.similarity_search(search_string, k=k)
+            matched_docs = self.backend.search(vector, k=k)
+
+        return self.format_docs(matched_docs)
+
+    def retrieve_batch(self, queries, k, max_workers=8):
+        """
+        Run several searches at once. `queries` is a list of (search_string, file) tuples, where file may be None.
+
+        All search strings are embedded in a single call, after which the (filtered) searches run concurrently.
+        Returns a list with the matched documents per query, in the order of `queries`.
+        """
+        if not queries:
+            return []
+
+        vectors = self.embeddings.embed_documents([search_string for search_string, _ in queries])
+
+        def search(vector, file):
+            if file:
+                return self.backend.search(vector, k=k, filter={"file": file})
+            return self.backend.search(vector, k=k)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(queries)))) as executor:
+            return list(executor.map(search, vectors, [file for _, file in queries]))
+
+    @staticmethod
+    def format_docs(docs):
+        code_str = ""
 
         # Paste results in one string
-        for doc in matched_docs:
+        for doc in docs:
             code_str += "THE CODE CHUNK BELOW IS FROM THIS FILE: " + doc.metadata['source'] + "\n"
+            if "symbol" in doc.metadata:
+                code_str += "THE CODE CHUNK BELOW DEFINES: " + doc.metadata['symbol'] + "\n"
+            if "kind" in doc.metadata:
+                code_str += "THE CODE CHUNK BELOW IS OF THIS KIND: " + doc.metadata['kind'] + "\n"
             if "content_type" in doc.metadata:
                 code_str += "THE CODE CHUNK BELOW IS OF THIS CONTENT_TYPE: " + doc.metadata['content_type'] + "\n\n"
             code_str += doc.page_content + "\n\n\n <ANOTHER POSSIBLY RELEVANT CODE CHUNK BELOW> \n\n\n"
 
         return code_str
 
-    def search_vectordb(self, code_needed):
-        code_str = ""
-        seen_strings = set()
+    def search_vectordb(self, code_needed, symbol_index=None):
+        # Every line names a file (first word), optionally followed by a code construct
+        queries = [(code, code.split(' ')[0]) for code in code_needed.split("\n") if code.strip()]
 
-        # split the string into a list of lines
-        code_needed_split = code_needed.split("\n")
+        # Code constructs found in the symbol index are read from disk, the other lines are searched
+        results = []
+        if symbol_index is not None:
+            resolved = [symbol_index.find_docs(code, file=file, max_symbols=1) for code, file in queries]
+            results = [docs for docs in resolved if docs]
+            queries = [query for query, docs in zip(queries, resolved) if not docs]
 
-        # loop over the lines
-        for code in code_needed_split:
-            # get file-name
-            file = code.split(' ')[0]
-            string = self.retrieve_embeddings(code, k=1, file=file)
-            # Check if the string has not been encountered before
-            if string not in seen_strings:
-                code_str += string
-                seen_strings.add(string)
+        # Keep the first occurrence of every chunk
+        unique_docs = {}
+        for docs in results + self.retrieve_batch(queries, k=1):
+            for doc in docs:
+                unique_docs.setdefault(doc.metadata.get('chunk_id', doc.page_content), doc)
 
-        return code_str
+        return self.format_docs(unique_docs.values())